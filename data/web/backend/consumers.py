@@ -1,13 +1,21 @@
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.db import database_sync_to_async
 from .models import User
+from pong.registry import registry
 import json, logging, time
 
 logger = logging.getLogger('pong')
 
 class LoginMenuConsumer(AsyncJsonWebsocketConsumer):
-	active_users = []
-	instances = []
+	"""
+	Online presence of a user. Who is online is kept in the registry, shared by
+	every worker, notifications reach the socket through its user group (see signals.py).
+	"""
+	online = 'online_users' # registry table, uuid -> channel name
+
+	@staticmethod
+	def user_group(user_id) -> str:
+		return f'user_{user_id}'
 
 	@database_sync_to_async
 	def authenticate_user(self, token):
@@ -19,7 +27,7 @@ class LoginMenuConsumer(AsyncJsonWebsocketConsumer):
 			self.jwt_token = self.scope['cookies'].get('jwt')
 			self.user = await self.authenticate_user(self.jwt_token)
 
-			if not self.jwt_token or not self.user or self.user in self.active_users:
+			if not self.jwt_token or not self.user or await registry.get(self.online, str(self.user.uuid)) is not None:
 				raise ValueError("Invalid connection attempt")
 
 			await self.accept()
@@ -36,9 +44,9 @@ class LoginMenuConsumer(AsyncJsonWebsocketConsumer):
 		
 		match data['action']:
 			case 'connect':
-				if self.user not in self.active_users:
-					self.active_users.append(self.user)
-					self.instances.append(self)
+				if (not registry.holds(self.online, str(self.user.uuid), self.channel_name)
+						and await registry.acquire(self.online, str(self.user.uuid), self.channel_name) == self.channel_name):
+					await self.channel_layer.group_add(self.user_group(self.user.id), self.channel_name)
 					self.user.status = True
 					await database_sync_to_async(self.user.save)()
 					self.last_ping = time.time()
@@ -52,8 +60,9 @@ class LoginMenuConsumer(AsyncJsonWebsocketConsumer):
 		if not self.jwt_token or not self.user:
 			return
 
-		if self.user in self.active_users:
-			self.active_users.remove(self.user)
+		if registry.holds(self.online, str(self.user.uuid), self.channel_name):
+			await registry.release(self.online, str(self.user.uuid))
+			await self.channel_layer.group_discard(self.user_group(self.user.id), self.channel_name)
 
 			# if the user model was updated since this consumer was created, the user object in this scope is outdated
 			# saving it would overwrite the database with the old user objects data
@@ -62,9 +71,6 @@ class LoginMenuConsumer(AsyncJsonWebsocketConsumer):
 			updated_user.status = False
 			await database_sync_to_async(updated_user.save)()
 
-		if self in self.instances:
-			self.instances.remove(self)
-
 		
 	async def broadcast(self, message):
 		await self.send(json.dumps(message))
@@ -72,4 +78,7 @@ class LoginMenuConsumer(AsyncJsonWebsocketConsumer):
 	async def broadcast_notification(self):
 		await self.broadcast({'event': 'notification',})
 
+	async def notify(self, event):
+		await self.broadcast(event['message'])
+
 
@@ -2,28 +2,26 @@ from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver, Signal
 from channels.db import database_sync_to_async
 from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from .models import FriendshipRequest, User, Ladderboard
 from .consumers import LoginMenuConsumer
 import logging
 
 logger = logging.getLogger('pong')
 
+def user_notification(message : dict) -> dict:
+	# handled by LoginMenuConsumer.notify on whichever worker the user is connected to
+	return {'type': 'notify', 'message': message}
+
+
 @receiver(post_delete, sender=FriendshipRequest)
 @receiver(post_save, sender=FriendshipRequest)
 def friendship_updated(sender, instance, **kwargs):
 	if instance:
-		receiver = instance.receiver
-		receiver_id = receiver.id
-	
-		for consumer in LoginMenuConsumer.instances:
-			if consumer.user.id == receiver_id:
-				async_to_sync(consumer.broadcast_notification)()
-				break
-
-		for consumer in LoginMenuConsumer.instances:
-			if consumer.user.id == instance.sender.id:
-				async_to_sync(consumer.broadcast_notification)()
-				break
+		channel_layer = get_channel_layer()
+		for user_id in (instance.receiver.id, instance.sender.id):
+			async_to_sync(channel_layer.group_send)(
+				LoginMenuConsumer.user_group(user_id), user_notification({'event': 'notification',}))
 
 
 profile_updated_signal = Signal()
@@ -31,10 +29,8 @@ profile_updated_signal = Signal()
 @receiver(profile_updated_signal)
 async def profile_updated(sender, **kwargs):
 	user : User = kwargs.get('user')
-	for consumer in LoginMenuConsumer.instances:
-		if consumer.user == user:
-			await consumer.broadcast_notification()
-			break
+	await get_channel_layer().group_send(
+		LoginMenuConsumer.user_group(user.id), user_notification({'event': 'notification',}))
 
 
 tournament_started_signal = Signal()
@@ -46,10 +42,8 @@ async def tournament_updated(sender, instance, **kwargs):
 	if instance: 
 		users = [await database_sync_to_async(User.objects.get)(username=username) for username in instance.players]
 		for user in users:
-			for consumer in LoginMenuConsumer.instances:
-				if consumer.user == user:
-					await consumer.broadcast({'event': 'tournament',})
-					break
+			await get_channel_layer().group_send(
+				LoginMenuConsumer.user_group(user.id), user_notification({'event': 'tournament',}))
 
 
 @receiver(post_save, sender=User)
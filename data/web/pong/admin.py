@@ -19,7 +19,8 @@ class OngoingGameAdmin(admin.ModelAdmin):
 class CompletedGameAdmin(admin.ModelAdmin):
     def __init__(self, model, admin_site):
         super().__init__(model, admin_site)
-        self.list_display = [field.name for field in model._meta.fields]
+        self.list_display = [field.name for field in model._meta.fields
+            if not isinstance(field, models.BinaryField)]
         self.list_filter = ('created_at', 'completed_at', 'winner_username')
         self.search_fields = [
             field.name for field in model._meta.fields 
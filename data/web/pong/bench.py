@@ -0,0 +1,178 @@
+from .pong_components import GAME_SETTINGS
+from .headless import HeadlessPongGame, track_ball
+from .protocol import GameSnapshot
+from .world import GameWorld
+import json, time, platform, tracemalloc, logging
+
+logger = logging.getLogger('pong')
+
+GAME_COUNTS = (1, 100, 1000)
+
+
+def new_game() -> HeadlessPongGame:
+	game = HeadlessPongGame(track_ball('left'), track_ball('right', dead_zone=45))
+	game.ball.wait_ticks = 0
+	return game
+
+
+def per_op(fn, repeat : int) -> float:
+	"""Average ns per call of fn over 'repeat' calls."""
+	start = time.perf_counter_ns()
+	for _ in range(repeat):
+		fn()
+	return (time.perf_counter_ns() - start) / repeat
+
+
+def bench_components(repeat : int) -> dict:
+	game = new_game()
+	ball, board = game.ball, game.scoreBoard
+
+	def ball_update():
+		ball.update(board, game.player1, game.player2)
+		if ball.is_waiting:
+			ball.wait_ticks = 0
+
+	def stepper(game):
+		def step():
+			game.apply_inputs()
+			game.step()
+			game.scoreBoard.events.clear()
+		return step
+
+	rewinding = new_game()
+	rewinding.enable_rewind()
+
+	return {
+		'step_ns': per_op(stepper(new_game()), repeat),
+		'step_rewind_ns': per_op(stepper(rewinding), repeat),
+		'ball_update_ns': per_op(ball_update, repeat),
+		'paddle_update_ns': per_op(game.paddleLeft.update, repeat),
+		'end_match_ns': per_op(board.end_match, repeat),
+		'get_start_data_ns': per_op(game.get_start_data, repeat),
+	}
+
+
+def bench_engine(games : int, ticks : int) -> dict:
+	"""Steps 'games' concurrent games together, one tick advances every game once."""
+	pool = [new_game() for _ in range(games)]
+	start = time.perf_counter_ns()
+	for _ in range(ticks):
+		for game in pool:
+			game.apply_inputs()
+			game.step()
+			game.scoreBoard.events.clear()
+	total = (time.perf_counter_ns() - start) / ticks
+	return {
+		'ns_per_tick': total,
+		'ns_per_game_tick': total / games,
+		'tick_budget_used': total / (1e9 / GAME_SETTINGS['engine']['tick_rate']),
+	}
+
+
+def bench_world(games : int, ticks : int) -> dict:
+	"""bench_engine on a GameWorld: the same matches and controllers, one vectorized step per tick."""
+	world = GameWorld(games)
+	for _ in range(games):
+		world.add_game()
+	world.wait[:] = 0
+	start = time.perf_counter_ns()
+	for _ in range(ticks):
+		world.track_ball('left')
+		world.track_ball('right', dead_zone=45)
+		world.step()
+	total = (time.perf_counter_ns() - start) / ticks
+	return {
+		'ns_per_tick': total,
+		'ns_per_game_tick': total / games,
+		'tick_budget_used': total / (1e9 / GAME_SETTINGS['engine']['tick_rate']),
+		'slow_steps_per_tick': world.slow_steps / ticks,
+	}
+
+
+def bench_serialization(frames : int) -> dict:
+	game = new_game()
+	results = {}
+	for fmt in ('text', 'binary'):
+		size = 0
+		start = time.perf_counter_ns()
+		for _ in range(frames):
+			game.step()
+			size += len(getattr(GameSnapshot(game), fmt))
+		elapsed = (time.perf_counter_ns() - start) / 1e9
+		results[fmt] = {
+			'bytes_per_frame': size / frames,
+			'frames_per_s': frames / elapsed,
+			'bytes_per_s': size / elapsed,
+		}
+	return results
+
+
+def bench_allocations(games : int, ticks : int) -> dict:
+	"""Net allocated blocks and peak traced bytes per tick, a leak shows up as a non-zero net."""
+	pool = [new_game() for _ in range(games)]
+	tracemalloc.start()
+	try:
+		before = tracemalloc.take_snapshot()
+		tracemalloc.reset_peak()
+		base, _ = tracemalloc.get_traced_memory()
+		for _ in range(ticks):
+			for game in pool:
+				game.apply_inputs()
+				game.step()
+				GameSnapshot(game).binary
+		_, peak = tracemalloc.get_traced_memory()
+		after = tracemalloc.take_snapshot()
+	finally:
+		tracemalloc.stop()
+	net_blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+	return {
+		'net_blocks_per_tick': net_blocks / ticks,
+		'peak_bytes_per_tick': (peak - base) / ticks,
+	}
+
+
+def run(ticks : int = 600, repeat : int = 20000) -> dict:
+	results = {
+		'meta': {
+			'timestamp': time.time(),
+			'python': platform.python_version(),
+			'machine': platform.machine(),
+			'tick_rate': GAME_SETTINGS['engine']['tick_rate'],
+			'send_rate': GAME_SETTINGS['engine']['send_rate'],
+		},
+		'components': bench_components(repeat),
+		'engine': {},
+		'world': {},
+		'serialization': bench_serialization(repeat),
+		'allocations': bench_allocations(100, ticks // 10),
+	}
+	for games in GAME_COUNTS:
+		results['engine'][str(games)] = bench_engine(games, max(10, ticks * 10 // games))
+		# at least 'ticks' steps, so balls get to walls and paddles and the scalar path is counted
+		world = bench_world(games, max(ticks, ticks * 10 // games))
+		world['speedup'] = results['engine'][str(games)]['ns_per_tick'] / world['ns_per_tick']
+		results['world'][str(games)] = world
+	return results
+
+
+def compare(current : dict, baseline : dict, tolerance : float = 0.15) -> list:
+	"""Returns the *_ns metrics that got slower than baseline by more than 'tolerance'."""
+	regressions = []
+
+	def walk(cur, base, path):
+		for key, value in cur.items():
+			if key not in base or base[key] is None:
+				continue
+			if isinstance(value, dict):
+				walk(value, base[key], f'{path}{key}.')
+			elif key.endswith('_ns') or key.startswith('ns_'):
+				if base[key] and value > base[key] * (1 + tolerance):
+					regressions.append((f'{path}{key}', base[key], value))
+
+	walk(current, baseline, '')
+	return regressions
+
+
+def write(results : dict, path : str):
+	with open(path, 'w') as f:
+		json.dump(results, f, indent=2)
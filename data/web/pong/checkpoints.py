@@ -0,0 +1,142 @@
+from .pong_components import GAME_SETTINGS
+from .timers import timer_wheel
+import asyncio, os, pickle, time, logging
+
+logger = logging.getLogger('pong')
+
+CHECKPOINT_VERSION = 2 # bumped whenever capture_state() changes shape
+
+
+class CheckpointStore:
+	"""One file per live game, replaced atomically so a crash never leaves a torn checkpoint."""
+	def __init__(self, directory : str, max_age : float):
+		self.directory = directory
+		self.max_age = max_age
+
+	def path(self, game_id : str) -> str:
+		return os.path.join(self.directory, f'{game_id}.ckpt')
+
+	def write(self, checkpoints : dict):
+		os.makedirs(self.directory, exist_ok=True)
+		for game_id, data in checkpoints.items():
+			tmp = self.path(game_id) + '.tmp'
+			with open(tmp, 'wb') as f:
+				f.write(data)
+			os.replace(tmp, self.path(game_id))
+
+	def load(self, game_id : str) -> dict:
+		"""The last checkpoint of 'game_id', stale or unreadable ones are discarded."""
+		path = self.path(game_id)
+		try:
+			if time.time() - os.path.getmtime(path) > self.max_age:
+				self.remove(game_id)
+				return None
+			with open(path, 'rb') as f:
+				data = pickle.load(f)
+		except FileNotFoundError:
+			return None
+		except Exception as e:
+			logger.error(f"Discarding unreadable checkpoint of {game_id}: {e}")
+			self.remove(game_id)
+			return None
+		if data.get('version') != CHECKPOINT_VERSION:
+			self.remove(game_id)
+			return None
+		return data
+
+	def purge(self) -> int:
+		"""Removes the checkpoints older than max_age, games nobody came back to after a restart."""
+		removed = 0
+		try:
+			names = os.listdir(self.directory)
+		except FileNotFoundError:
+			return 0
+		for name in names:
+			path = os.path.join(self.directory, name)
+			try:
+				if time.time() - os.path.getmtime(path) > self.max_age:
+					os.remove(path)
+					removed += 1
+			except OSError:
+				pass
+		return removed
+
+	def remove(self, game_id : str):
+		try:
+			os.remove(self.path(game_id))
+		except FileNotFoundError:
+			pass
+
+
+class Checkpointer:
+	"""
+	Snapshots every tracked game every 'interval' seconds. Capturing happens on the
+	event loop (a few µs per game), the file writes in a worker thread. Games whose
+	tick did not move since their last checkpoint (suspended ones) are skipped.
+	"""
+	def __init__(self, store : CheckpointStore, interval : float):
+		self.store = store
+		self.interval = interval
+		self.games = {}
+		self.timer = None
+		self.written = 0
+		self.purged : int = None
+
+	def track(self, game):
+		self.games[game] = -1
+		if self.timer is None:
+			self.timer = timer_wheel.call_later(self.interval, self.run)
+
+	def untrack(self, game):
+		# called from end_game() inside the engine tick, the file goes away in a worker thread
+		if self.games.pop(game, None) is not None:
+			asyncio.create_task(asyncio.to_thread(self.store.remove, game.game_id))
+
+	async def run(self):
+		self.timer = None
+		if self.purged is None:
+			self.purged = await asyncio.to_thread(self.store.purge)
+		checkpoints = {}
+		for game, last_tick in list(self.games.items()):
+			if game.tick_count == last_tick or not game.running:
+				continue
+			self.games[game] = game.tick_count
+			checkpoints[game.game_id] = pickle.dumps(game.checkpoint())
+		if checkpoints:
+			try:
+				await asyncio.to_thread(self.store.write, checkpoints)
+				self.written += len(checkpoints)
+			except OSError as e:
+				logger.error(f"Error writing {len(checkpoints)} checkpoints: {e}")
+		# games that ended while we were writing
+		tracked = {game.game_id for game in self.games}
+		for game_id in checkpoints:
+			if game_id not in tracked:
+				await asyncio.to_thread(self.store.remove, game_id)
+		if self.games:
+			self.timer = timer_wheel.call_later(self.interval, self.run)
+
+	async def flush(self):
+		"""Checkpoints every tracked game right away, e.g. before the process exits."""
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
+		for game in self.games:
+			self.games[game] = -1
+		await self.run()
+
+	def stats(self) -> dict:
+		return {
+			'tracked': len(self.games),
+			'written': self.written,
+			'purged': self.purged,
+		}
+
+
+checkpointer = Checkpointer(
+	CheckpointStore(
+		os.path.join(GAME_SETTINGS['persistence']['data_dir'], GAME_SETTINGS['persistence']['checkpoint_dir']),
+		GAME_SETTINGS['persistence']['checkpoint_max_age'],
+	),
+	GAME_SETTINGS['persistence']['checkpoint_interval'],
+)
@@ -1,12 +1,20 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from .pong import PongGame, MultiPongGame, AiPongGame
-from .pong_components import Player
+from .pong_components import Player, GAME_SETTINGS
 from multiprocessing import Process
 from .ai.pong_ai_components import AITraining
 from .db_api import GameDB
 from .models import User
-import json, os, neat, logging
+from .protocol import GameSnapshot
+from .outbox import Outbox
+from .playback import ReplayPlayback
+from .scores import score_buffer
+from .checkpoints import checkpointer
+from .shards import shard_pool, ShardedGame
+from .registry import registry
+from .latency import LinkMonitor
+import asyncio, json, os, neat, logging
 
 
 logger = logging.getLogger('pong')
@@ -21,6 +29,9 @@ class SinglePongConsumer(AsyncWebsocketConsumer):
 		self.jwt_token = None
 		self.user : User = None
 		self.game : PongGame = None
+		self.binary = False
+		self.outbox : Outbox = None
+		self.link : LinkMonitor = None
 	
 	@database_sync_to_async
 	def authenticate_user(self, token):
@@ -39,7 +50,7 @@ class SinglePongConsumer(AsyncWebsocketConsumer):
 			self.user : User = await self.authenticate_user(self.jwt_token)
 			self.id = self.get_user_id()
 
-			if not self.jwt_token or not self.user or self.id in self.active_games:
+			if not self.jwt_token or not self.user or await self.in_single_game():
 				raise ValueError("Invalid connection attempt")
 
 		except Exception as e:
@@ -49,12 +60,20 @@ class SinglePongConsumer(AsyncWebsocketConsumer):
 		await self.accept()
 
 
+	async def in_single_game(self) -> bool:
+		# active_games only holds this worker's games, the registry knows about every worker's
+		return self.id in self.active_games or await registry.get('single_games', str(self.id)) is not None
+
+
 	async def disconnect(self, close_code):
+		self.cancel_outbox()
+		self.stop_link()
 		if self.id in self.active_games:
 			if not self.game:
 				return
 			self.game.remove_consumer(self)
 			del self.active_games[self.id]
+			await registry.release('single_games', str(self.id))
 
 
 	async def receive(self, text_data):
@@ -65,7 +84,9 @@ class SinglePongConsumer(AsyncWebsocketConsumer):
 			case 'connect':
 				if self.id not in self.active_games:
 					self.active_games[self.id] = self.id
+					await registry.acquire('single_games', str(self.id), self.channel_name)
 				
+				self.binary = bool(data.get('binary'))
 				mode = 'ai' if data.get('mode') == 'ai' else 'vs'
 				self.game = PongGame(mode)
 				self.game.add_consumer(self)
@@ -74,35 +95,73 @@ class SinglePongConsumer(AsyncWebsocketConsumer):
 				
 
 			case 'paddle_move_start':
-					paddle = self.game.paddleLeft if data.get('side') == 'left' else self.game.paddleRight
-					paddle.direction = -1 if data.get('direction') == 'up' else 1
+					side = 'left' if data.get('side') == 'left' else 'right'
+					self.game.queue_input(side, -1 if data.get('direction') == 'up' else 1, *self.input_stamp(data))
 			case 'paddle_move_stop':
-					paddle = self.game.paddleLeft if data.get('side') == 'left' else self.game.paddleRight
-					paddle.direction = 0
-
+					side = 'left' if data.get('side') == 'left' else 'right'
+					self.game.queue_input(side, 0, *self.input_stamp(data))
+			case 'pong':
+					self.on_pong(data)
+
+
+	@staticmethod
+	def input_stamp(data : dict) -> tuple:
+		"""
+		(seq, tick) of a paddle input: the client sequence number acknowledged back in
+		the snapshots, and the server tick the client was looking at when it was sent.
+		"""
+		stamp = tuple(data.get(key) for key in ('seq', 'tick'))
+		return tuple(value if isinstance(value, int) and not isinstance(value, bool) else None for value in stamp)
+
+	def enqueue(self, text_data : str = None, bytes_data : bytes = None, droppable : bool = False):
+		if self.outbox is None:
+			self.outbox = Outbox(self)
+		self.outbox.put(text_data, bytes_data, droppable)
+
+	def cancel_outbox(self):
+		if self.outbox is not None:
+			self.outbox.cancel()
+
+	def start_link(self):
+		if self.link is None:
+			self.link = LinkMonitor(self)
+		self.link.start()
+
+	def stop_link(self):
+		if self.link is not None:
+			self.link.stop()
+
+	def on_pong(self, data : dict):
+		if self.link is not None:
+			self.link.on_pong(data.get('id'))
+
+	async def shutdown(self):
+		# close only after everything already queued (e.g. game_end) is delivered
+		if self.outbox is not None:
+			self.outbox.close()
+		else:
+			await self.close()
 
 	async def broadcast(self, message):
-		try:
-			await self.send(json.dumps(message))
-		except Exception as e:
-			logger.error(f"Error sending message: {e}")
+		self.enqueue(json.dumps(message))
 
 	async def broadcast_game_start(self, game):
 		await self.broadcast({
 			'event': 'game_start',
 			'state': game.get_start_data()
 		})
+		self.start_link()
 
-	async def broadcast_game_state(self, game):
-		await self.broadcast({
-			'event': 'game_state',
-			'state': {
-				'l_paddle_y': game.paddleLeft.y,
-				'r_paddle_y': game.paddleRight.y,
-				'ball_x': game.ball.x,
-				'ball_y': game.ball.y,
-			}
-		})
+	def broadcast_snapshot(self, snapshot: GameSnapshot):
+		if self.link is not None and not self.link.wants_frame():
+			return
+		if self.binary:
+			self.enqueue(bytes_data=snapshot.binary, droppable=True)
+		else:
+			self.enqueue(snapshot.text, droppable=True)
+
+	async def broadcast_game_state(self, snapshot: GameSnapshot):
+		self.broadcast_snapshot(snapshot)
 
 	async def broadcast_game_end(self, winner: Player):
 		await self.broadcast({
@@ -121,7 +180,11 @@ class MultiPongConsumer(SinglePongConsumer):
 
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
-		
+
+	def get_user_id(self):
+		# a str like QuickLobby.get_user_id, so it matches the lobby's 'matches' entries
+		uuid = self.user.uuid if self.user else None
+		return str(uuid) if uuid else None
 	
 	async def connect(self):
 		try:
@@ -149,6 +212,12 @@ class MultiPongConsumer(SinglePongConsumer):
 			
 		match data['action']:
 			case 'connect':
+				self.binary = bool(data.get('binary'))
+				if not await self.claim_game():
+					return
+				self.drop_ended_game()
+				if self.game_id not in self.active_games:
+					await self.restore_game()
 				if self.game_id not in self.active_games:
 					await self.create_game()
 				elif self.is_full():
@@ -160,15 +229,20 @@ class MultiPongConsumer(SinglePongConsumer):
 					await self.active_games[self.game_id]['game'].start()
 			
 			case 'paddle_move_start':
-				if paddle := self.get_player_paddle():
-					paddle.direction = -1 if data.get('direction') == 'up' else 1
+				if side := self.get_player_side():
+					self.game.queue_input(side, -1 if data.get('direction') == 'up' else 1, *self.input_stamp(data))
 			
 			case 'paddle_move_stop':
-				if paddle := self.get_player_paddle():
-					paddle.direction = 0
+				if side := self.get_player_side():
+					self.game.queue_input(side, 0, *self.input_stamp(data))
+
+			case 'pong':
+				self.on_pong(data)
 
 
 	async def disconnect(self, close_code):
+		self.cancel_outbox()
+		self.stop_link()
 		if not self.game:
 			return
 
@@ -185,21 +259,58 @@ class MultiPongConsumer(SinglePongConsumer):
 
 				# only remove game if both consumers are gone
 				if not game_entry['left']['socket'] and not game_entry['right']['socket']:
-					if (winner := game_entry['game'].scoreBoard.end_match()):
-						await GameDB.complete_game(game_entry['game'].game_id, winner.player_id)
+					replay = game_entry['game'].replay.encode()
+					await score_buffer.flush()
+					if (winner := game_entry['game'].winner()):
+						await GameDB.complete_game(game_entry['game'].game_id, winner.player_id, replay)
 					else:
 						#await GameDB.complete_game(game_entry['game'].game_id, self.player_id)
-						await GameDB.complete_game(game_entry['game'].game_id, self.user.username)
-					await GameDB.delete_game(self.game_id)
+						await GameDB.complete_game(game_entry['game'].game_id, self.user.username, replay)
+					score_buffer.forget(self.game_id)
 					del self.active_games[self.game_id]
+					await registry.release('games', self.game_id)
+
+
+	async def claim_game(self) -> bool:
+		"""
+		A game is simulated by the one worker holding its lease, active_games only
+		knows the games of this worker. Sockets that reached another worker are told
+		to reconnect, the load balancer routes by game_id (see nginx default.conf).
+		Only the game's players get that far, anyone else would lease it for nothing.
+		"""
+		if not await self.is_member():
+			await self.shutdown()
+			return False
+		owner = await registry.acquire('games', self.game_id)
+		if owner == registry.worker_id:
+			return True
+		await self.broadcast({
+			'event': 'moved',
+			'state': {
+				'owner': owner,
+				'retry_after': GAME_SETTINGS['cluster']['moved_retry'],
+				'max_retries': GAME_SETTINGS['cluster']['moved_max_retries']
+			}
+		})
+		await self.shutdown()
+		return False
+
 
+	async def is_member(self) -> bool:
+		"""A player of this worker's game, of the lobby match that created it, or of its ongoing game row."""
+		if self.is_rejoin():
+			return True
+		if self.player_id in (await registry.get('matches', self.game_id) or ()):
+			return True
+		return await GameDB.player_in_game(self.player_id) == self.game_id
 
-	def get_player_paddle(self):
+
+	def get_player_side(self):
 		game = self.active_games.get(self.game_id)
 		if not game:
 			return None
-		return (game['game'].paddleLeft if self.player_id == game['left']['id'] 
-				else game['game'].paddleRight if self.player_id == game['right']['id'] 
+		return ('left' if self.player_id == game['left']['id'] 
+				else 'right' if self.player_id == game['right']['id'] 
 				else None)
 	
 
@@ -207,7 +318,7 @@ class MultiPongConsumer(SinglePongConsumer):
 		self.active_games[self.game_id] = {
 			'left': {'id': self.player_id, 'socket': self},
 			'right': None,
-			'game': MultiPongGame(self.game_id)
+			'game': ShardedGame(self.game_id) if shard_pool.enabled else MultiPongGame(self.game_id)
 		}
 		self.game = self.active_games[self.game_id]['game']
 		self.active_games[self.game_id]['game'].add_consumer(self)
@@ -217,17 +328,45 @@ class MultiPongConsumer(SinglePongConsumer):
 		game_entry = self.active_games[self.game_id]
 		game_entry['right'] = {'id': self.player_id, 'socket': self}
 		game = game_entry['game']
+		game.player_uuids = (game_entry['left']['id'], self.player_id)
 		self.game = game
 		game.add_consumer(self)
 		await game.init_game_components()
 		await GameDB.create_game(self.game_id, game_entry['left']['id'], self.player_id)
 
 
+	def drop_ended_game(self):
+		"""Forgets an entry whose game ended with nobody connected, e.g. abandoned after a restore."""
+		game_entry = self.active_games.get(self.game_id)
+		if not game_entry or game_entry['game'].running:
+			return
+		if not any(game_entry[side] and game_entry[side]['socket'] for side in ('left', 'right')):
+			del self.active_games[self.game_id]
+
+
+	async def restore_game(self):
+		"""Brings back a game checkpointed before a restart, its players then rejoin it as usual."""
+		if not (data := await asyncio.to_thread(checkpointer.store.load, self.game_id)):
+			return
+		if self.game_id in self.active_games:
+			# the other player restored it while the file was being read
+			return
+		game = MultiPongGame.from_checkpoint(data)
+		left, right = game.player_uuids
+		self.active_games[self.game_id] = {
+			'left': {'id': left, 'socket': None},
+			'right': {'id': right, 'socket': None},
+			'game': game
+		}
+		logger.info(f"Restored game {self.game_id} at tick {game.tick_count} from checkpoint")
+
+
 	async def rejoin_game(self):
 		game_entry = self.active_games[self.game_id]
 		side = 'left' if (game_entry['left'] and game_entry['left']['id'] == self.player_id) else 'right'
 		game_entry[side]['socket'] = self
 		self.game = game_entry['game']
+		self.game.reset_ack(side)
 		self.game.add_consumer(self)
 		await self.broadcast_game_start(self.game)
 
@@ -249,9 +388,118 @@ class MultiPongConsumer(SinglePongConsumer):
 				game_entry['right'] and game_entry['right']['socket'])
 	
 	
-	async def broadcast_game_score(self, score_data: dict):
-		await super().broadcast_game_score(score_data)
-		await GameDB.update_score(self.game_id, score_data['state']['player1_sets'], score_data['state']['player2_sets'])
+
+class SpectatorConsumer(SinglePongConsumer):
+	"""Read-only viewer of a live MultiPongConsumer game, frames come through the game's SpectatorGroup."""
+	async def connect(self):
+		try:
+			self.jwt_token = self.scope['cookies'].get('jwt')
+			self.user : User = await self.authenticate_user(self.jwt_token)
+			if not self.jwt_token or not self.user:
+				raise ValueError("Invalid connection attempt")
+
+		except Exception as e:
+			await self.close()
+			return
+
+		self.game_id = self.scope['url_route']['kwargs']['game_id']
+		await self.accept()
+
+
+	async def disconnect(self, close_code):
+		self.cancel_outbox()
+		self.stop_link()
+		if self.game:
+			self.game.spectators.remove(self)
+
+
+	async def receive(self, text_data):
+		data = json.loads(text_data)
+		if data.get('action') == 'pong':
+			self.on_pong(data)
+		if data.get('action') != 'connect' or self.game:
+			return
+
+		self.binary = bool(data.get('binary'))
+		game_entry = MultiPongConsumer.active_games.get(self.game_id)
+		if not game_entry:
+			await self.close()
+			return
+
+		if not game_entry['game'].spectators.add(self):
+			await self.broadcast({'event': 'spectate_full'})
+			await self.shutdown()
+			return
+
+		self.game = game_entry['game']
+		if self.game.running:
+			await self.broadcast_game_start(self.game)
+
+
+class ReplayConsumer(SinglePongConsumer):
+	"""Plays a finished match back from its recorded inputs, see playback.py."""
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.playback : ReplayPlayback = None
+
+	async def connect(self):
+		try:
+			self.jwt_token = self.scope['cookies'].get('jwt')
+			self.user : User = await self.authenticate_user(self.jwt_token)
+			if not self.jwt_token or not self.user:
+				raise ValueError("Invalid connection attempt")
+
+		except Exception as e:
+			await self.close()
+			return
+
+		self.game_id = self.scope['url_route']['kwargs']['game_id']
+		await self.accept()
+
+
+	async def disconnect(self, close_code):
+		self.cancel_outbox()
+		self.stop_link()
+		if self.playback:
+			self.playback.stop()
+
+
+	async def receive(self, text_data):
+		data = json.loads(text_data)
+		if 'action' not in data:
+			return
+
+		if data['action'] != 'connect' and not self.playback:
+			return
+
+		match data['action']:
+			case 'connect':
+				if self.playback:
+					return
+				self.binary = bool(data.get('binary'))
+				record = await GameDB.get_replay(self.game_id)
+				if not record:
+					await self.close()
+					return
+				self.playback = ReplayPlayback(
+					record['replay'],
+					(record['player1_username'], record['player2_username']),
+					record['winner_username'],
+				)
+				self.playback.add_consumer(self)
+				await self.broadcast({'event': 'game_start', 'state': self.playback.get_start_data()})
+				await self.playback.play()
+
+			case 'play':
+				await self.playback.play()
+			case 'pause':
+				self.playback.pause()
+			case 'speed':
+				self.playback.set_speed(data.get('speed'))
+			case 'seek':
+				if isinstance(data.get('tick'), (int, float)):
+					await self.playback.seek(data['tick'])
+
 
 class AIConsumer(SinglePongConsumer):
 	def __init__(self, *args, **kwargs):
@@ -276,7 +524,7 @@ class AIConsumer(SinglePongConsumer):
 				self.user : User = await self.authenticate_user(self.jwt_token)
 				self.id = self.get_user_id()
 
-				if not self.jwt_token or not self.user or self.id in self.active_games:
+				if not self.jwt_token or not self.user or await self.in_single_game():
 					raise ValueError("Invalid connection attempt")
 
 			except Exception as e:
@@ -287,11 +535,14 @@ class AIConsumer(SinglePongConsumer):
 
 
 	async def disconnect(self, close_code):
+		self.cancel_outbox()
+		self.stop_link()
 		if self.id in self.active_games:
 			if not self.game:
 				return
 			self.game.remove_consumer(self)
 			del self.active_games[self.id]
+			await registry.release('single_games', str(self.id))
 
 	async def receive(self, text_data):
 		data = json.loads(text_data)
@@ -301,16 +552,18 @@ class AIConsumer(SinglePongConsumer):
 			case 'connect':
 				if self.id not in self.active_games:
 					self.active_games[self.id] = self.id
+					await registry.acquire('single_games', str(self.id), self.channel_name)
 
+				self.binary = bool(data.get('binary'))
 				self.game = AiPongGame()
 				self.game.add_consumer(self)
 				await self.game.init_game_components()
 				await self.game.start()
 
 			case 'paddle_move_start':
-				paddle = self.game.paddleLeft
-				paddle.direction = -1 if data.get('direction') == 'up' else 1
+				self.game.queue_input('left', -1 if data.get('direction') == 'up' else 1, *self.input_stamp(data))
 			case 'paddle_move_stop':
-				paddle = self.game.paddleLeft
-				paddle.direction = 0
+				self.game.queue_input('left', 0, *self.input_stamp(data))
+			case 'pong':
+				self.on_pong(data)
 
@@ -1,5 +1,49 @@
 from channels.db import database_sync_to_async
 from .models import OngoingGame, CompletedGame
+from .pong_components import GAME_SETTINGS
+from .timers import timer_wheel
+import asyncio, logging
+
+logger = logging.getLogger('pong')
+
+
+class CompletionBatcher:
+	"""
+	Collects game completions arriving within 'window' seconds of each other
+	(e.g. a tournament round ending) and commits them in one transaction.
+	"""
+	def __init__(self, window : float):
+		self.window = window
+		self.pending = []
+		self.timer = None
+		self.batches = 0
+
+	def submit(self, game_id : str, winner : str, replay : bytes = None) -> asyncio.Future:
+		future = asyncio.get_running_loop().create_future()
+		self.pending.append(((game_id, winner, replay), future))
+		if self.timer is None:
+			self.timer = timer_wheel.call_later(self.window, self.flush)
+		return future
+
+	async def flush(self):
+		self.timer = None
+		batch, self.pending = self.pending, []
+		if not batch:
+			return
+		try:
+			created = await database_sync_to_async(CompletedGame.complete_many)([result for result, _ in batch])
+		except Exception as e:
+			logger.error(f"Error completing {len(batch)} games: {e}")
+			for _, future in batch:
+				future.set_exception(e)
+			return
+		self.batches += 1
+		for (game_id, _, _), future in batch:
+			future.set_result(game_id in created)
+
+
+completion_batcher = CompletionBatcher(GAME_SETTINGS['persistence']['completion_window'])
+
 
 class GameDB:
 	@staticmethod
@@ -22,14 +66,14 @@ class GameDB:
 	
 
 	@staticmethod
-	async def complete_game(game_id: str, winner: str):
-		try:
-			ongoing = await database_sync_to_async(OngoingGame.objects.get)(game_id=game_id)
-			await database_sync_to_async(CompletedGame.create_from_ongoing)(ongoing, winner)
-			return True
-		except OngoingGame.DoesNotExist:
-			return False
+	async def complete_game(game_id: str, winner: str, replay: bytes = None):
+		"""Moves the game to CompletedGame and applies ranks atomically, batched with other games ending together."""
+		return await completion_batcher.submit(game_id, winner, replay)
 		
+	@staticmethod
+	async def get_replay(game_id: str):
+		return await database_sync_to_async(CompletedGame.get_replay)(game_id)
+
 	@staticmethod
 	async def is_duplicate_game_id(game_id: str):
 		return await database_sync_to_async(CompletedGame.is_duplicate_id)(game_id)
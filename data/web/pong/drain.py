@@ -0,0 +1,113 @@
+from .pong_components import GAME_SETTINGS
+from .engine import tick_engine
+from .checkpoints import checkpointer
+from .scores import score_buffer
+from .pong import PongGame
+from .shards import shard_pool
+from .registry import registry
+import asyncio, signal, time, logging
+
+logger = logging.getLogger('pong')
+
+
+class DrainController:
+	"""
+	Takes the worker out of rotation for a deploy: lobbies stop forming matches
+	(clients get a retry hint), games already in flight keep ticking, and the
+	process exits once the last game is over or the deadline passes. Games still
+	running at the deadline are checkpointed first so they can be restored by
+	the next worker.
+
+	Started with POST /pong/drain/ or SIGUSR1, see install_signal_handler().
+	"""
+	def __init__(self):
+		self.draining = False
+		self.deadline : float = None
+		self.started_at : float = None
+		self.task : asyncio.Task = None
+
+	def remaining_games(self) -> int:
+		# suspended multiplayer games are off the tick engine but still in flight, sharded ones are on a worker
+		games = {game for game in tick_engine.games if isinstance(game, PongGame)}
+		return len(games | set(checkpointer.games) | set(shard_pool.games.values()))
+
+	def retry_after(self) -> int:
+		return GAME_SETTINGS['drain']['retry_after']
+
+	def status(self) -> dict:
+		return {
+			'draining': self.draining,
+			'remaining_games': self.remaining_games(),
+			'started_at': self.started_at,
+			'seconds_left': max(0.0, self.deadline - time.time()) if self.deadline else None,
+		}
+
+	async def start(self, timeout : float = None):
+		if self.draining:
+			return
+		self.draining = True
+		self.started_at = time.time()
+		self.deadline = self.started_at + (timeout or GAME_SETTINGS['drain']['timeout'])
+		logger.info(f"Draining: {self.remaining_games()} games in flight, deadline in {self.deadline - self.started_at:.0f}s")
+		from .lobby import QuickLobby
+		await QuickLobby.turn_away_queued()
+		self.task = asyncio.create_task(self.watch())
+
+	async def watch(self):
+		while (remaining := self.remaining_games()) and time.time() < self.deadline:
+			logger.info(f"Draining: {remaining} games remaining")
+			await asyncio.sleep(GAME_SETTINGS['drain']['poll_interval'])
+
+		if remaining:
+			logger.warning(f"Drain deadline passed with {remaining} games, checkpointing them")
+			await checkpointer.flush()
+		await score_buffer.flush()
+		# lets another worker take over checkpointed games without waiting for the leases to expire
+		await registry.release_all()
+		logger.info("Drained, shutting down")
+		self.stop_server()
+
+	def stop_server(self):
+		"""
+		Shuts the server down through its own stop path. Daphne runs on a twisted
+		reactor, stopping it closes the listeners and lets daphne shut the
+		applications down. Any other server gets the SIGTERM it already handles.
+		"""
+		try:
+			from twisted.internet import reactor
+		except ImportError:
+			reactor = None
+		if reactor is not None and reactor.running:
+			reactor.stop()
+		else:
+			signal.raise_signal(signal.SIGTERM)
+
+
+drain = DrainController()
+
+
+def install_signal_handler():
+	"""
+	SIGUSR1 starts the drain. The handler goes on the server's own event loop, so
+	this runs from that loop (see drain_on_signal). Only the main thread can take
+	signals: under the autoreloader the server runs in another thread and only
+	POST /pong/drain/ is available.
+	"""
+	loop = asyncio.get_running_loop()
+	try:
+		loop.add_signal_handler(signal.SIGUSR1, lambda: asyncio.ensure_future(drain.start()))
+	except (RuntimeError, ValueError, NotImplementedError) as e:
+		logger.warning(f"No SIGUSR1 drain trigger here ({e}), use POST /pong/drain/")
+
+
+def drain_on_signal(application):
+	"""ASGI wrapper installing the SIGUSR1 handler from the server loop on the first connection."""
+	installed = False
+
+	async def app(scope, receive, send):
+		nonlocal installed
+		if not installed:
+			installed = True
+			install_signal_handler()
+		return await application(scope, receive, send)
+	return app
@@ -0,0 +1,86 @@
+from .pong_components import GAME_SETTINGS
+import asyncio, time, logging
+
+logger = logging.getLogger('pong')
+
+class TickEngine:
+	"""
+	Process-wide fixed timestep scheduler.
+	Every registered game is advanced from a single loop, the next deadline is
+	computed from the previous one (not from 'now') so sleeps never accumulate drift.
+	"""
+	def __init__(self, rate : int, max_catchup : int = 5):
+		self.rate = rate
+		self.dt = 1 / rate
+		self.max_catchup = max_catchup
+		self.games = {}
+		self.task : asyncio.Task = None
+		self.tick_count = 0
+		self.last_overrun = 0.0
+		self.max_overrun = 0.0
+		self.overruns = 0
+		self.skipped_steps = 0
+
+	def register(self, game):
+		self.games[game] = None
+		if not self.task or self.task.done():
+			self.task = asyncio.create_task(self.run())
+
+	def unregister(self, game):
+		self.games.pop(game, None)
+
+	def is_registered(self, game) -> bool:
+		return game in self.games
+
+	def stats(self) -> dict:
+		return {
+			'rate': self.rate,
+			'games': len(self.games),
+			'tick_count': self.tick_count,
+			'last_overrun': self.last_overrun,
+			'max_overrun': self.max_overrun,
+			'overruns': self.overruns,
+			'skipped_steps': self.skipped_steps,
+		}
+
+	def steps_due(self, next_tick : float, now : float):
+		"""
+		Returns how many fixed steps to run this tick and the next deadline.
+		Missed steps are caught up to max_catchup, anything beyond that is dropped
+		and the schedule is re-anchored to 'now'.
+		"""
+		missed = int((now - next_tick) / self.dt)
+		if missed <= 0:
+			return 1, next_tick + self.dt
+		steps = 1 + min(missed, self.max_catchup)
+		if missed > self.max_catchup:
+			self.skipped_steps += missed - self.max_catchup
+			logger.warning(f"Tick engine dropped {missed - self.max_catchup} steps ({len(self.games)} games)")
+			return steps, now + self.dt
+		return steps, next_tick + steps * self.dt
+
+	async def run(self):
+		next_tick = time.perf_counter() + self.dt
+		while self.games:
+			delay = next_tick - time.perf_counter()
+			if delay > 0:
+				await asyncio.sleep(delay)
+
+			start = time.perf_counter()
+			steps, next_tick = self.steps_due(next_tick, start)
+
+			for game in list(self.games):
+				try:
+					await game.tick(steps)
+				except Exception as e:
+					logger.error(f"Error ticking game, unregistering: {e}")
+					self.unregister(game)
+			self.tick_count += steps
+
+			self.last_overrun = max(0.0, time.perf_counter() - start - self.dt)
+			if self.last_overrun > 0:
+				self.overruns += 1
+				self.max_overrun = max(self.max_overrun, self.last_overrun)
+
+
+tick_engine = TickEngine(GAME_SETTINGS['engine']['tick_rate'], GAME_SETTINGS['engine']['max_catchup'])
@@ -0,0 +1,97 @@
+from .pong_components import Paddle, Ball, Player, ScoreBoard, GameField, GAME_SETTINGS
+from .pong import PongGame
+import time
+
+
+def track_ball(side : str, dead_zone : int = 20):
+	"""Paddle controller that follows the ball, handy as a scripted opponent."""
+	def controller(game, tick):
+		paddle = game.paddleLeft if side == 'left' else game.paddleRight
+		diff = (game.ball.y + game.ball.size / 2) - (paddle.y + paddle.height / 2)
+		return 0 if abs(diff) < dead_zone else (1 if diff > 0 else -1)
+	return controller
+
+
+def scripted(script : dict):
+	"""Paddle controller replaying a {tick: direction} script, direction holds until the next entry."""
+	state = {'direction': 0}
+	def controller(game, tick):
+		state['direction'] = script.get(tick, state['direction'])
+		return state['direction']
+	return controller
+
+
+class HeadlessPongGame(PongGame):
+	"""
+	PongGame stepped as fast as the CPU allows: no consumers, no tick engine and
+	no asyncio. The serve countdown runs on the step counter (virtual clock) and
+	paddle inputs come from controllers called once per step as controller(game, tick).
+	"""
+	def __init__(self, left=None, right=None, player_ids=('player1', 'player2'), seed : int = None):
+		super().__init__('vs', seed)
+		self.left = left
+		self.right = right
+		self.player_ids = player_ids
+		self.setup()
+
+	def setup(self):
+		self.paddleLeft = Paddle(GAME_SETTINGS['l_paddle']['start_x'], GAME_SETTINGS['l_paddle']['start_y'])
+		self.paddleRight = Paddle(GAME_SETTINGS['r_paddle']['start_x'], GAME_SETTINGS['r_paddle']['start_y'])
+		self.ball = Ball(self.rng)
+		self.gamefield = GameField()
+		self.player1 = Player(self.player_ids[0], self.paddleLeft)
+		self.player2 = Player(self.player_ids[1], self.paddleRight)
+		self.scoreBoard = ScoreBoard(self, self.player1, self.player2)
+		self.ball.reset(self.scoreBoard, self.player1, self.player2)
+
+	def apply_inputs(self):
+		if self.left:
+			self.set_direction('left', self.left(self, self.tick_count))
+		if self.right:
+			self.set_direction('right', self.right(self, self.tick_count))
+
+	def run(self, max_ticks : int = None, record_ticks : bool = False) -> dict:
+		"""Plays the match to the end (or max_ticks) and returns the final scoreboard and tick stats."""
+		max_ticks = max_ticks or 60 * 60 * GAME_SETTINGS['engine']['tick_rate']
+		tick_times = [] if record_ticks else None
+		slowest = 0
+		winner = None
+		start = time.perf_counter_ns()
+
+		while self.tick_count < max_ticks:
+			tick_start = time.perf_counter_ns()
+			self.apply_inputs()
+			self.step()
+			for event, player in self.scoreBoard.drain():
+				if event == 'match_end':
+					winner = player
+			elapsed = time.perf_counter_ns() - tick_start
+			slowest = max(slowest, elapsed)
+			if record_ticks:
+				tick_times.append(elapsed)
+			if winner:
+				break
+
+		total = time.perf_counter_ns() - start
+		stats = {
+			'winner': winner.player_id if winner else None,
+			'ticks': self.tick_count,
+			'game_seconds': self.tick_count / GAME_SETTINGS['engine']['tick_rate'],
+			'player1_score': self.player1.score,
+			'player2_score': self.player2.score,
+			'player1_sets': self.player1.sets,
+			'player2_sets': self.player2.sets,
+			'elapsed_ns': total,
+			'ns_per_tick': total / max(1, self.tick_count),
+			'max_tick_ns': slowest,
+		}
+		if record_ticks:
+			stats['tick_ns'] = tick_times
+		return stats
+
+
+def simulate(matches : int, left_factory=None, right_factory=None, max_ticks : int = None) -> list:
+	"""Runs 'matches' headless games back to back, factories build a fresh controller per match. See world.simulate_batch() to run them side by side."""
+	left_factory = left_factory or (lambda: track_ball('left'))
+	right_factory = right_factory or (lambda: track_ball('right', dead_zone=45))
+	return [HeadlessPongGame(left_factory(), right_factory()).run(max_ticks) for _ in range(matches)]
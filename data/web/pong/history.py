@@ -0,0 +1,46 @@
+import collections
+
+
+class HistoryEntry:
+	__slots__ = ('tick', 'state', 'inputs')
+
+	def __init__(self, tick : int, state : dict):
+		self.tick = tick
+		self.state = state # PongGame.capture_state() before the inputs of 'tick', paddle directions included
+		self.inputs = [] # (side, direction) applied at 'tick'
+
+
+class StateHistory:
+	"""
+	Fixed-size ring buffer of the last 'size' ticks of a game, what a late input
+	needs to be re-applied at the tick the client saw (see PongGame.rewind).
+	"""
+	def __init__(self, size : int):
+		self.entries = collections.deque(maxlen=size)
+
+	def __len__(self):
+		return len(self.entries)
+
+	def push(self, tick : int, state : dict) -> HistoryEntry:
+		entry = HistoryEntry(tick, state)
+		self.entries.append(entry)
+		return entry
+
+	@property
+	def last(self) -> HistoryEntry:
+		return self.entries[-1] if self.entries else None
+
+	@property
+	def oldest_tick(self) -> int:
+		return self.entries[0].tick if self.entries else None
+
+	def rewind_to(self, tick : int) -> list:
+		"""Removes and returns the entries from 'tick' on, oldest first."""
+		removed = []
+		while self.entries and self.entries[-1].tick >= tick:
+			removed.append(self.entries.pop())
+		removed.reverse()
+		return removed
+
+	def clear(self):
+		self.entries.clear()
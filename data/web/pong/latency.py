@@ -0,0 +1,109 @@
+from .pong_components import GAME_SETTINGS
+from .timers import timer_wheel
+import json, time, logging
+
+logger = logging.getLogger('pong')
+
+
+class LinkMonitor:
+	"""
+	RTT probe of one game socket. Every probe_interval seconds a 'ping' goes
+	through the socket's outbox (so queueing behind frames counts) and the client
+	answers with a 'pong' action. RTT and jitter are smoothed with the TCP weights
+	(RFC 6298: 1/8 and 1/4).
+
+	The socket only gets one in 'divisor' of the game's frames: the divisor
+	doubles when the link looks congested (frames dropped by the outbox, pings
+	lost, or srtt + 4 * jitter above rtt_high) and halves again after
+	recover_probes healthy probes below rtt_low.
+	"""
+	def __init__(self, consumer):
+		self.consumer = consumer
+		self.settings = GAME_SETTINGS['latency']
+		self.srtt : float = None # ms
+		self.rttvar : float = None # ms
+		self.last_rtt : float = None
+		self.samples = 0
+		self.lost = 0
+		self.outstanding = {} # ping id -> perf_counter when queued
+		self.next_id = 0
+		self.divisor = 1
+		self.healthy = 0
+		self.seen_dropped = 0
+		self.seen_lost = 0
+		self.frames = 0
+		self.timer = None
+
+	def start(self):
+		if self.timer is None:
+			self.timer = timer_wheel.call_later(self.settings['probe_interval'], self.probe)
+
+	def stop(self):
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
+
+	def probe(self):
+		self.timer = None
+		# a ping still unanswered a whole interval later is counted lost
+		self.lost += len(self.outstanding)
+		self.outstanding.clear()
+		self.adapt()
+		self.next_id += 1
+		self.outstanding[self.next_id] = time.perf_counter()
+		self.consumer.enqueue(json.dumps({
+			'event': 'ping',
+			'state': {
+				'id': self.next_id,
+				'divisor': self.divisor,
+			}
+		}))
+		self.timer = timer_wheel.call_later(self.settings['probe_interval'], self.probe)
+
+	def on_pong(self, ping_id):
+		sent = self.outstanding.pop(ping_id, None)
+		if sent is None:
+			return
+		rtt = (time.perf_counter() - sent) * 1000
+		if self.srtt is None:
+			self.srtt, self.rttvar = rtt, rtt / 2
+		else:
+			self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+			self.srtt = 0.875 * self.srtt + 0.125 * rtt
+		self.last_rtt = rtt
+		self.samples += 1
+
+	def congested(self) -> bool:
+		outbox = self.consumer.outbox
+		dropped = outbox.dropped if outbox is not None else 0
+		new_drops, self.seen_dropped = dropped - self.seen_dropped, dropped
+		new_lost, self.seen_lost = self.lost - self.seen_lost, self.lost
+		slow = self.srtt is not None and self.srtt + 4 * self.rttvar > self.settings['rtt_high']
+		return bool(new_drops or new_lost or slow)
+
+	def adapt(self):
+		if self.congested():
+			self.healthy = 0
+			if self.divisor < self.settings['max_divisor']:
+				self.divisor *= 2
+				logger.debug(f"{self.consumer.get_username()}: link congested, 1 in {self.divisor} frames")
+		elif self.srtt is not None and self.srtt < self.settings['rtt_low']:
+			self.healthy += 1
+			if self.divisor > 1 and self.healthy >= self.settings['recover_probes']:
+				self.divisor //= 2
+				self.healthy = 0
+
+	def wants_frame(self) -> bool:
+		self.frames += 1
+		return self.frames % self.divisor == 0
+
+	def stats(self) -> dict:
+		return {
+			'user': self.consumer.get_username(),
+			'srtt_ms': self.srtt,
+			'jitter_ms': self.rttvar,
+			'last_rtt_ms': self.last_rtt,
+			'samples': self.samples,
+			'lost': self.lost,
+			'divisor': self.divisor,
+		}
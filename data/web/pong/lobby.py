@@ -2,11 +2,20 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from .models import User
 from .db_api import GameDB
+from .drain import drain
+from .registry import registry
+from .pong_components import GAME_SETTINGS
 import json, time, secrets, logging
 
 logger = logging.getLogger('pong')
 class QuickLobby(AsyncWebsocketConsumer):
+	"""
+	Waiting players live in the registry so any worker can match them, matches
+	reach the sockets through the channel layer. queued_players only holds the
+	sockets connected to this worker.
+	"""
 	queued_players = {}
+	lobby = 'lobby' # registry table and channel group of every waiting player
 
 	def generate_game_id(self) -> str:
 		timestamp = int(time.time())
@@ -52,19 +61,33 @@ class QuickLobby(AsyncWebsocketConsumer):
 			await self.close()
 			return
 		
+		if drain.draining:
+			await self.accept()
+			await self.turn_away()
+			return
+
 		if await GameDB.is_duplicate_game_id(self.generate_game_id()):
 			await self.close()
 			return
 
-		await self.accept()		
+		await self.accept()
+		self.entry = self.queue_entry()
+		# whichever worker matches this player removes the entry, see match_players
+		if await registry.acquire(self.lobby, self.player_id, self.entry, handoff=True) != self.entry:
+			# already waiting from another socket
+			await self.close()
+			return
 		self.queued_players[self.player_id] = self
+		await self.channel_layer.group_add(self.lobby, self.channel_name)
 		await self.broadcast_player_count()
 		await self.try_match_players()
 
 
 	async def disconnect(self, close_code):
-		if hasattr(self, 'player_id') and self.player_id in self.queued_players:
+		if hasattr(self, 'player_id') and self.queued_players.get(self.player_id) is self:
 			del self.queued_players[self.player_id]
+			await registry.release(self.lobby, self.player_id)
+			await self.channel_layer.group_discard(self.lobby, self.channel_name)
 			await self.broadcast_player_count()
 
 
@@ -74,69 +97,118 @@ class QuickLobby(AsyncWebsocketConsumer):
 			return
 
 
+	async def turn_away(self):
+		"""Tells the client this worker is draining, it retries (and lands on another worker) later."""
+		await self.send(json.dumps({
+			'event': 'draining',
+			'state': {
+				'retry_after': drain.retry_after()
+			}
+		}))
+		await self.close()
+
+	@classmethod
+	async def turn_away_queued(cls):
+		"""Sends away the players already waiting on this worker when the drain starts."""
+		for player_id, consumer in list(cls.queued_players.items()):
+			del cls.queued_players[player_id]
+			await registry.release(cls.lobby, player_id)
+			await consumer.channel_layer.group_discard(cls.lobby, consumer.channel_name)
+			await consumer.turn_away()
+
+
+	def queue_entry(self) -> dict:
+		return {
+			'channel': self.channel_name,
+			'username': self.user.username,
+			'game_id': None,
+			'queued_at': time.time(),
+		}
+
+	async def waiting_players(self) -> list:
+		"""(player_id, entry) of every queued player, longest waiting first."""
+		entries = await registry.items(self.lobby)
+		return sorted(entries.items(), key=lambda item: item[1]['queued_at'])
+
+
 	async def try_match_players(self):
-		if len(self.queued_players) >= 2:
-			player_ids = list(self.queued_players.keys())[:2]
-			game_id = f"{self.generate_game_id()}"
-			
-			player_usernames = [self.queued_players[player_id].user.username 
-								for player_id in player_ids]
-			
-			for i in range(len(player_ids)):
-				player = self.queued_players[player_ids[i]]
-				match_data = {
-					'event': 'match_found',
-					'state': {
-						'game_id': game_id,
-						'game_url': f'wss/mpong/game/{game_id}/',
-						'player_id': player_usernames[i]  
-					}
-				}
-				await player.send(json.dumps(match_data))
-				del self.queued_players[player_ids[i]]
-				await player.close()
+		players = await self.waiting_players()
+		if len(players) >= 2:
+			await self.match_players(players[:2], self.generate_game_id())
 		
 		await self.broadcast_player_count()
 
 
+	async def match_players(self, players : list, game_id : str):
+		# removing an entry is what decides which worker matched that player
+		taken = []
+		for player_id, entry in players:
+			if not await registry.delete(self.lobby, player_id, entry):
+				break
+			taken.append((player_id, entry))
+		if len(taken) < len(players):
+			for player_id, entry in taken:
+				await registry.set(self.lobby, player_id, entry, registry.lease_ttl)
+			return
+
+		# the two players may now claim the game, see MultiPongConsumer.claim_game
+		await registry.set('matches', game_id, [player_id for player_id, _ in taken], GAME_SETTINGS['cluster']['match_ttl'])
+		for player_id, entry in taken:
+			await self.channel_layer.send(entry['channel'], {
+				'type': 'match.found',
+				'game_id': game_id,
+				'username': entry['username'],
+			})
+
+
+	async def match_found(self, event):
+		registry.forget(self.lobby, self.player_id)
+		self.queued_players.pop(self.player_id, None)
+		match_data = {
+			'event': 'match_found',
+			'state': {
+				'game_id': event['game_id'],
+				'game_url': f'wss/mpong/game/{event["game_id"]}/',
+				'player_id': event['username']
+			}
+		}
+		await self.send(json.dumps(match_data))
+		await self.channel_layer.group_discard(self.lobby, self.channel_name)
+		await self.close()
+
+
 	async def broadcast_player_count(self):
-		for player in self.queued_players.values():
-			await player.send(json.dumps({
-				'event': 'player_count',
-				'state': {
-					'player_count': len(self.queued_players)
-				}
-			}))
+		await self.channel_layer.group_send(self.lobby, {
+			'type': 'player.count',
+			'player_count': await registry.count(self.lobby),
+		})
+
+	async def player_count(self, event):
+		await self.send(json.dumps({
+			'event': 'player_count',
+			'state': {
+				'player_count': event['player_count']
+			}
+		}))
 
 class TournamentLobby(QuickLobby):
 
 	def generate_game_id(self) -> str:
 		return self.scope['url_route']['kwargs']['game_id']
 
+	def queue_entry(self) -> dict:
+		return {**super().queue_entry(), 'game_id': self.generate_game_id()}
+
 	async def try_match_players(self):
-		if len(self.queued_players) < 2:
+		players = await self.waiting_players()
+		if len(players) < 2:
 			return
 			
 		game_id = self.generate_game_id()
-		tournament_players = [player_id for player_id, ws in self.queued_players.items()
-			if ws.scope['url_route']['kwargs']['game_id'] == game_id][:2]
+		tournament_players = [(player_id, entry) for player_id, entry in players
+			if entry['game_id'] == game_id][:2]
 		
 		if len(tournament_players) >= 2:
-				tournament_usernames = [self.queued_players[player_id].user.username 
-										for player_id in tournament_players]
-				
-				for i, player_id in enumerate(tournament_players):
-					player = self.queued_players[player_id]
-					match_data = {
-						'event': 'match_found',
-						'state': {
-							'game_id': game_id,
-							'game_url': f'wss/mpong/game/{game_id}/',
-							'player_id': tournament_usernames[i] 
-						}
-					}
-					await player.send(json.dumps(match_data))
-					del self.queued_players[player_id]
-					await player.close()
+				await self.match_players(tournament_players, game_id)
 		
-		await self.broadcast_player_count()
\ No newline at end of file
+		await self.broadcast_player_count()
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from pong import bench
+import json
+
+
+class Command(BaseCommand):
+	help = 'Benchmarks the pong engine hot path and writes the results as JSON'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--output', help='write results to this file instead of stdout')
+		parser.add_argument('--compare', help='baseline results file, fails on regressions')
+		parser.add_argument('--tolerance', type=float, default=0.15, help='allowed slowdown vs baseline (default 0.15)')
+		parser.add_argument('--ticks', type=int, default=600)
+
+	def handle(self, *args, **options):
+		results = bench.run(ticks=options['ticks'])
+
+		if options['output']:
+			bench.write(results, options['output'])
+		else:
+			self.stdout.write(json.dumps(results, indent=2))
+
+		if options['compare']:
+			with open(options['compare']) as f:
+				baseline = json.load(f)
+			regressions = bench.compare(results, baseline, options['tolerance'])
+			for metric, before, after in regressions:
+				self.stderr.write(f'{metric}: {before:.0f}ns -> {after:.0f}ns')
+			if regressions:
+				raise CommandError(f'{len(regressions)} benchmark regressions')
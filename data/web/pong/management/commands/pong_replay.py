@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from pong.models import CompletedGame
+from pong import replay
+
+
+class Command(BaseCommand):
+	help = 'Re-simulates recorded matches headlessly and checks the result against the stored sets'
+
+	def add_arguments(self, parser):
+		parser.add_argument('game_ids', nargs='*', help='games to replay (default: every game with a replay)')
+
+	def handle(self, *args, **options):
+		games = CompletedGame.objects.exclude(replay=None)
+		if options['game_ids']:
+			games = games.filter(game_id__in=options['game_ids'])
+
+		mismatches = 0
+		for game in games.iterator():
+			result = replay.simulate(game.replay, (game.player1_username, game.player2_username))
+			expected = (game.player1_sets, game.player2_sets)
+			actual = (result['player1_sets'], result['player2_sets'])
+			status = 'ok' if actual == expected else 'MISMATCH'
+			mismatches += actual != expected
+			self.stdout.write(f'{game.game_id}: stored {expected} replayed {actual} in {result["ticks"]} ticks [{status}]')
+
+		if mismatches:
+			raise CommandError(f'{mismatches} replays diverged from the recorded result')
@@ -0,0 +1,76 @@
+import bisect
+
+# seconds, the 60 Hz frame budget (16.6ms) sits in the middle of the range
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.0166, 0.025, 0.05, 0.1)
+
+
+class Histogram:
+	"""Fixed-bucket histogram, cheap enough to observe on every tick."""
+	def __init__(self, buckets : tuple = TIME_BUCKETS):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+		self.max = 0.0
+
+	def observe(self, value : float):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+		if value > self.max:
+			self.max = value
+
+	def summary(self) -> dict:
+		return {
+			'count': self.count,
+			'mean': self.sum / self.count if self.count else 0.0,
+			'max': self.max,
+		}
+
+	def prometheus(self, name : str) -> list:
+		lines = [f'# TYPE {name} histogram']
+		cumulative = 0
+		for bound, count in zip(self.buckets, self.counts):
+			cumulative += count
+			lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+		lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+		lines.append(f'{name}_sum {self.sum}')
+		lines.append(f'{name}_count {self.count}')
+		return lines
+
+
+# process-wide aggregates, every GameMetrics also feeds these
+tick_duration = Histogram()
+tick_jitter = Histogram()
+send_duration = Histogram()
+
+
+class GameMetrics:
+	"""Per-game tick instrumentation: duration, jitter against the engine step, send time."""
+	def __init__(self, dt : float):
+		self.dt = dt
+		self.last_tick = None
+		self.tick_duration = Histogram()
+		self.tick_jitter = Histogram()
+		self.send_duration = Histogram()
+
+	def tick(self, start : float, end : float, steps : int):
+		duration = end - start
+		self.tick_duration.observe(duration)
+		tick_duration.observe(duration)
+		if self.last_tick is not None:
+			jitter = abs(start - self.last_tick - steps * self.dt)
+			self.tick_jitter.observe(jitter)
+			tick_jitter.observe(jitter)
+		self.last_tick = start
+
+	def send(self, duration : float):
+		self.send_duration.observe(duration)
+		send_duration.observe(duration)
+
+	def summary(self) -> dict:
+		return {
+			'tick_duration': self.tick_duration.summary(),
+			'tick_jitter': self.tick_jitter.summary(),
+			'send_duration': self.send_duration.summary(),
+		}
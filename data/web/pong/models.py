@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from backend.models import User
 from django.contrib.postgres.fields import ArrayField, HStoreField
 from django.contrib.postgres.operations import HStoreExtension
@@ -79,18 +79,18 @@ class CompletedGame(Game):
 	winner_username = models.CharField(max_length=150)
 	winner_id = models.CharField(max_length=150, null=True)
 	completed_at = models.DateTimeField(auto_now_add=True)
+	replay = models.BinaryField(null=True, blank=True) # seed + input log, see pong/replay.py
 
 	@classmethod
-	def create_from_ongoing(cls, ongoing_game, winner: str):
-		
+	def build_from_ongoing(cls, ongoing_game, winner: str, replay: bytes = None):
+		"""Unsaved CompletedGame for an ongoing one, plus the winner and loser uuids."""
 		winner_id = next((uuid for uuid, username in ongoing_game.player_ids.items() 
 					if username == winner), None)
 
 		loser_id = next((uuid for uuid, username in ongoing_game.player_ids.items() 
 					if uuid != winner_id), None)
 
-		cls.update_user_rank(winner_id, loser_id)
-		return cls.objects.create(
+		completed = cls(
 			game_id=ongoing_game.game_id,
 			player_ids=ongoing_game.player_ids,
 			player1_username=ongoing_game.player1_username,
@@ -98,23 +98,66 @@ class CompletedGame(Game):
 			player1_sets=ongoing_game.player1_sets,
 			player2_sets=ongoing_game.player2_sets,
 			winner_username=winner,
-			winner_id=winner_id 
+			winner_id=winner_id,
+			replay=replay
 		)
-	
+		return completed, winner_id, loser_id
+
+	@classmethod
+	def complete_many(cls, results: list) -> dict:
+		"""
+		Completes every (game_id, winner, replay) in one transaction: the ongoing rows
+		are locked, moved with a single bulk insert and deleted, and the ranks of all
+		the players involved are updated together (see update_user_rank).
+		Returns the created CompletedGames by game_id, missing games are skipped.
+		"""
+		with transaction.atomic():
+			ongoing = OngoingGame.objects.select_for_update().filter(game_id__in=[r[0] for r in results])
+			ongoing = {game.game_id: game for game in ongoing}
+			completed = []
+			matches = []
+			for game_id, winner, replay in results:
+				if game_id not in ongoing:
+					continue
+				game, winner_id, loser_id = cls.build_from_ongoing(ongoing.pop(game_id), winner, replay)
+				completed.append(game)
+				if winner_id and loser_id:
+					matches.append((winner_id, loser_id))
+
+			created = cls.objects.bulk_create(completed)
+			cls.update_user_rank(matches)
+			OngoingGame.objects.filter(game_id__in=[game.game_id for game in created]).delete()
+		return {game.game_id: game for game in created}
+
 	@classmethod
-	def update_user_rank(cls, w_uuid, l_uuid):
-		if w_uuid and l_uuid:
-			try:
-				winner = User.objects.get(uuid=w_uuid)
-				winner.rank = winner.rank + 1
-				winner.save()
-				loser = User.objects.get(uuid=l_uuid)
+	def update_user_rank(cls, matches: list):
+		"""
+		Applies (winner uuid, loser uuid) results in order, a loser never drops below 0.
+		The players are locked and loaded with one query and each saved once, save()
+		keeps the post_save ladderboard signal in charge of the ladderboard.
+		"""
+		if not matches:
+			return
+		uuids = {str(uuid) for match in matches for uuid in match}
+		users = {str(user.uuid): user for user in User.objects.select_for_update().filter(uuid__in=list(uuids))}
+		changed = {}
+		for w_uuid, l_uuid in matches:
+			winner, loser = users.get(str(w_uuid)), users.get(str(l_uuid))
+			if winner is None:
+				continue
+			winner.rank += 1
+			changed[winner.pk] = winner
+			if loser is not None:
 				loser.rank = max(0, loser.rank - 1)
-				loser.save()
+				changed[loser.pk] = loser
+		for user in changed.values():
+			user.save(update_fields=['rank'])
+
+	@classmethod
+	def get_replay(cls, game_id):
+		return (cls.objects.filter(game_id=game_id).exclude(replay=None)
+			.values('replay', 'player1_username', 'player2_username', 'winner_username').first())
 
-			except User.DoesNotExist:
-				pass
-				
 	@classmethod
 	def is_duplicate_id(cls, game_id):
 		return cls.objects.filter(game_id=game_id).exists()
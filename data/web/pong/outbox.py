@@ -0,0 +1,123 @@
+from .pong_components import GAME_SETTINGS
+import asyncio, collections, logging, time
+
+logger = logging.getLogger('pong')
+
+# frames written, stale frames dropped, puts on a full queue and sockets closed
+# for going past send_queue_hard, summed over every Outbox of this process
+outbox_stats = {
+	'sent': 0,
+	'dropped': 0,
+	'full': 0,
+	'overflows': 0,
+}
+
+_CLOSE = object()
+
+
+class Outbox:
+	"""
+	Bounded outbound queue for one websocket, drained by its own writer task so a
+	slow client never stalls the game tick.
+	When the queue is full the stalest game_state frame is dropped in favour of the
+	newest one (or the newest one itself if no frame is queued), every other event
+	(score, start, end) is delivered. A client so stalled that 'hard_limit' events
+	pile up is disconnected.
+	"""
+	def __init__(self, consumer, maxsize : int = None, hard_limit : int = None):
+		self.consumer = consumer
+		self.maxsize = maxsize or GAME_SETTINGS['network']['send_queue']
+		self.hard_limit = hard_limit or GAME_SETTINGS['network']['send_queue_hard']
+		self.queue = collections.deque()
+		self.ready = asyncio.Event()
+		self.closed = False
+		self.sent = 0
+		self.dropped = 0
+		self.full = 0
+		self.high_water = 0
+		self.send_time = 0.0
+		self.task = asyncio.create_task(self.writer())
+
+	def __len__(self):
+		return len(self.queue)
+
+	def put(self, text_data : str = None, bytes_data : bytes = None, droppable : bool = False):
+		if self.closed:
+			return
+		if len(self.queue) >= self.maxsize:
+			self.full += 1
+			outbox_stats['full'] += 1
+			if droppable and not self.drop_stale():
+				self.count_drop()
+				return
+			if len(self.queue) >= self.hard_limit:
+				self.overflow()
+				return
+		self.queue.append((droppable, text_data, bytes_data))
+		self.high_water = max(self.high_water, len(self.queue))
+		self.ready.set()
+
+	def drop_stale(self) -> bool:
+		for i, item in enumerate(self.queue):
+			if item is not _CLOSE and item[0]:
+				del self.queue[i]
+				self.count_drop()
+				return True
+		return False
+
+	def count_drop(self):
+		self.dropped += 1
+		outbox_stats['dropped'] += 1
+
+	def overflow(self):
+		"""The writer is stuck on a client that stopped reading, give up on it."""
+		logger.warning(f"Closing {self.consumer.get_username()}: {len(self.queue)} events queued")
+		outbox_stats['overflows'] += 1
+		self.cancel()
+		asyncio.create_task(self.consumer.close())
+
+	def close(self):
+		"""Flushes what is queued, then closes the socket."""
+		if not self.closed:
+			self.queue.append(_CLOSE)
+			self.closed = True
+			self.ready.set()
+
+	def cancel(self):
+		self.closed = True
+		self.queue.clear()
+		self.task.cancel()
+
+	def stats(self) -> dict:
+		return {
+			'queued': len(self.queue),
+			'sent': self.sent,
+			'dropped': self.dropped,
+			'full': self.full,
+			'high_water': self.high_water,
+			'send_time': self.send_time,
+		}
+
+	async def writer(self):
+		while True:
+			while not self.queue:
+				self.ready.clear()
+				await self.ready.wait()
+
+			item = self.queue.popleft()
+			if item is _CLOSE:
+				await self.consumer.close()
+				return
+
+			_, text_data, bytes_data = item
+			start = time.perf_counter()
+			try:
+				await self.consumer.send(text_data=text_data, bytes_data=bytes_data)
+			except Exception as e:
+				logger.error(f"Error sending message: {e}")
+				self.closed = True
+				self.queue.clear()
+				return
+			self.send_time += time.perf_counter() - start
+			self.sent += 1
+			outbox_stats['sent'] += 1
@@ -0,0 +1,131 @@
+from .pong_components import GAME_SETTINGS
+from .headless import HeadlessPongGame
+from .replay import ReplayRecorder
+from .engine import tick_engine
+import asyncio, bisect, logging
+
+logger = logging.getLogger('pong')
+
+
+class ReplayPlayback:
+	"""
+	Streams a finished match back to a viewer by re-simulating it from its replay.
+	Registered with the tick engine like a live game, every engine step advances
+	'speed' simulation steps. A keyframe (PongGame.capture_state) is kept every
+	keyframe_interval ticks as the match is simulated, so a seek only re-simulates
+	from the nearest keyframe at or before the target.
+	"""
+	def __init__(self, blob : bytes, player_ids=('player1', 'player2'), winner : str = None):
+		self.replay = ReplayRecorder.decode(blob)
+		self.game = HeadlessPongGame(player_ids=player_ids, seed=self.replay.seed)
+		self.winner = winner
+		self.input_ticks = [tick for tick, _, _ in self.replay.inputs]
+		self.cursor = 0
+		self.speed = 1
+		self.playing = False
+		self.finished = False
+		self.engine_ticks = 0
+		self.next_send = 0
+		self.keyframe_interval = GAME_SETTINGS['replay']['keyframe_interval'] * GAME_SETTINGS['engine']['tick_rate']
+		self.keyframes = {0: self.game.capture_state()}
+
+	def add_consumer(self, consumer):
+		self.game.add_consumer(consumer)
+
+	def get_start_data(self) -> dict:
+		return {
+			**self.game.get_start_data(),
+			'replay_ticks': self.replay.ticks,
+			'speeds': GAME_SETTINGS['replay']['speeds'],
+		}
+
+	def at_end(self) -> bool:
+		return self.game.tick_count >= self.replay.ticks or self.game.scoreBoard.end_match() is not None
+
+	def step(self):
+		tick = self.game.tick_count
+		inputs = self.replay.inputs
+		while self.cursor < len(inputs) and inputs[self.cursor][0] <= tick:
+			_, side, direction = inputs[self.cursor]
+			(self.game.paddleLeft if side == 'left' else self.game.paddleRight).direction = direction
+			self.cursor += 1
+		self.game.step()
+		if self.game.tick_count % self.keyframe_interval == 0:
+			self.keyframes.setdefault(self.game.tick_count, self.game.capture_state())
+
+
+	async def tick(self, steps : int = 1):
+		for _ in range(steps * self.speed):
+			if self.at_end():
+				break
+			self.step()
+		if self.game.scoreBoard.events:
+			self.game.scoreBoard.drain()
+			await self.game.scoreBoard.send()
+
+		self.engine_ticks += steps
+		if self.engine_ticks >= self.next_send:
+			self.next_send = self.engine_ticks + self.game.send_interval
+			await self.game.broadcast_game_state()
+
+		if self.at_end():
+			await self.finish()
+
+
+	async def play(self):
+		if not self.finished:
+			self.playing = True
+			tick_engine.register(self)
+
+	def pause(self):
+		self.playing = False
+		tick_engine.unregister(self)
+
+	def set_speed(self, speed : int):
+		if speed in GAME_SETTINGS['replay']['speeds']:
+			self.speed = speed
+
+
+	async def seek(self, tick : int):
+		"""Jumps to 'tick', restoring the closest keyframe unless stepping on from here is shorter."""
+		tick = max(0, min(int(tick), self.replay.ticks))
+		tick_engine.unregister(self)
+
+		start = max(k for k in self.keyframes if k <= tick)
+		if not start <= self.game.tick_count <= tick:
+			self.game.restore_state(self.keyframes[start])
+			self.cursor = bisect.bisect_left(self.input_ticks, start)
+
+		# seeking past what has been simulated so far, yield between chunks so live games keep ticking
+		while self.game.tick_count < tick and not self.at_end():
+			for _ in range(min(self.keyframe_interval, tick - self.game.tick_count)):
+				self.step()
+			await asyncio.sleep(0)
+
+		self.finished = False
+		self.game.scoreBoard.drain()
+		await self.game.scoreBoard.send()
+		for consumer in self.game.consumers:
+			await consumer.broadcast({'event': 'replay_seek', 'state': {'tick': self.game.tick_count}})
+		await self.game.broadcast_game_state()
+		if self.playing:
+			await self.play()
+
+
+	async def finish(self):
+		tick_engine.unregister(self)
+		self.finished = True
+		self.playing = False
+		winner = self.game.scoreBoard.end_match()
+		for consumer in self.game.consumers:
+			await consumer.broadcast({
+				'event': 'game_end',
+				'state': {
+					'winner': winner.player_id if winner else self.winner
+				}
+			})
+
+	def stop(self):
+		self.playing = False
+		tick_engine.unregister(self)
+		self.game.consumers.clear()
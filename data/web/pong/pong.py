@@ -1,11 +1,27 @@
-from .pong_components import Paddle, Ball, Player, AIPlayer, ScoreBoard, GameField, GAME_SETTINGS
-import asyncio, neat, os, time, logging, pickle
+from .pong_components import Paddle, Ball, Player, AIPlayer, ScoreBoard, GameField, GAME_SETTINGS, STEP_SCALE
+import asyncio, collections, neat, os, time, logging, pickle, random, secrets
 from .ai.pong_ai_components import AITraining
+from .engine import tick_engine
+from .protocol import GameSnapshot
+from .metrics import GameMetrics
+from .replay import ReplayRecorder
+from .spectators import SpectatorGroup
+from .timers import timer_wheel, TimerHandle
+from .scores import score_buffer
+from .db_api import GameDB
+from .checkpoints import checkpointer, CHECKPOINT_VERSION
+from .history import StateHistory
+from .registry import registry
 
 logger = logging.getLogger('pong')
 class PongGame():
-	def __init__(self, mode='vs'):
+	def __init__(self, mode='vs', seed : int = None):
 		self.consumers = []
+		self.presence = collections.Counter() # username -> connected consumers
+		self.seed = seed if seed is not None else secrets.randbits(32)
+		self.rng = random.Random(self.seed)
+		self.rng_state = None # ((ball, ball.draws), rng.getstate()) reused until the ball draws again
+		self.replay = ReplayRecorder(self.seed)
 		self.mode = mode
 		self.running : bool = False
 		self.paddleLeft : Paddle = None
@@ -15,19 +31,42 @@ class PongGame():
 		self.ball : Ball = None
 		self.scoreBoard : ScoreBoard = None
 		self.gamefield : GameField = None
+		self.tick_count = 0
+		self.send_interval = max(1, GAME_SETTINGS['engine']['tick_rate'] // GAME_SETTINGS['engine']['send_rate'])
+		self.next_send_tick = 0
+		self.serializations = 0
+		self.frames_sent = 0
+		self.metrics = GameMetrics(tick_engine.dt)
+		self.spectators = SpectatorGroup(self)
+		self.pending_inputs = collections.deque() # (side, direction, seq, seen tick) applied at the start of the next step
+		self.input_acks = {'left': 0, 'right': 0} # last client seq applied per side, sent back in every snapshot
+		self.history : StateHistory = None # recent ticks for lag compensation, see enable_rewind()
+		self.rewinds = 0
+		self.rewound_ticks = 0
+		self.rewinds_refused = 0
 
 	def add_consumer(self, consumer):
 		self.consumers.append(consumer)
+		self.presence[consumer.get_username()] += 1
+		self.presence_changed()
 
 	def remove_consumer(self, consumer):
 		if consumer in self.consumers:
 			self.consumers.remove(consumer)
+			username = consumer.get_username()
+			self.presence[username] -= 1
+			if self.presence[username] <= 0:
+				del self.presence[username]
+			self.presence_changed()
+
+	def presence_changed(self):
+		pass
 
 
 	async def init_game_components(self):
 		self.paddleLeft = Paddle(GAME_SETTINGS['l_paddle']['start_x'], GAME_SETTINGS['l_paddle']['start_y'])
 		self.paddleRight = Paddle(GAME_SETTINGS['r_paddle']['start_x'], GAME_SETTINGS['r_paddle']['start_y'])
-		self.ball = Ball()
+		self.ball = Ball(self.rng)
 		self.gamefield = GameField()
 		await self.setup_players()
 		self.scoreBoard = ScoreBoard(self, self.player1, self.player2)
@@ -57,62 +96,244 @@ class PongGame():
 			'paddle_width': GAME_SETTINGS['paddle']['width'],
 			'paddle_height': GAME_SETTINGS['paddle']['height'],
 			'ball_size': self.ball.size,
+			'tick_rate': GAME_SETTINGS['engine']['tick_rate'],
+			'send_rate': GAME_SETTINGS['engine']['send_rate'],
+			'spectate_rate': GAME_SETTINGS['spectate']['send_rate'],
+			'paddle_speed': GAME_SETTINGS['paddle']['velo'] * STEP_SCALE * GAME_SETTINGS['engine']['tick_rate'],
 		}
 
-	async def game_loop(self):
-		self.ball.reset(self.scoreBoard, self.player1, self.player2)
+	def get_state_data(self):
+		return {
+			'l_paddle_y': self.paddleLeft.y,
+			'r_paddle_y': self.paddleRight.y,
+			'ball_x': self.ball.x,
+			'ball_y': self.ball.y,
+			'l_ack': self.input_acks['left'],
+			'r_ack': self.input_acks['right'],
+		}
+
+	def capture_state(self) -> dict:
+		"""Everything step() depends on, enough to resume the simulation bit-for-bit with restore_state()."""
+		return {
+			'tick_count': self.tick_count,
+			'paddles': [(p.y, p.direction) for p in (self.paddleLeft, self.paddleRight)],
+			'ball': (self.ball.x, self.ball.y, self.ball.dx, self.ball.dy,
+				self.ball.velo, self.ball.wait_ticks, self.ball.carry),
+			'players': [(p.score, p.sets) for p in (self.player1, self.player2)],
+			'last_scored': (None if self.scoreBoard.last_scored is None
+				else 'left' if self.scoreBoard.last_scored is self.player1 else 'right'),
+			'rng': self.rng_snapshot(),
+		}
+
+	def rng_snapshot(self) -> tuple:
+		"""rng.getstate() copies 625 words, it only changes when the ball serves or bounces."""
+		key = (self.ball, self.ball.draws)
+		if self.rng_state is None or self.rng_state[0] != key:
+			self.rng_state = (key, self.rng.getstate())
+		return self.rng_state[1]
+
+	def restore_state(self, state : dict):
+		self.tick_count = state['tick_count']
+		for paddle, (y, direction) in zip((self.paddleLeft, self.paddleRight), state['paddles']):
+			paddle.y, paddle.direction = y, direction
+		(self.ball.x, self.ball.y, self.ball.dx, self.ball.dy,
+			self.ball.velo, self.ball.wait_ticks, self.ball.carry) = state['ball']
+		for player, (score, sets) in zip((self.player1, self.player2), state['players']):
+			player.score, player.sets = score, sets
+		self.scoreBoard.last_scored = {'left': self.player1, 'right': self.player2}.get(state['last_scored'])
+		self.rng.setstate(state['rng'])
+		self.rng_state = ((self.ball, self.ball.draws), state['rng'])
+
+	def set_direction(self, side : str, direction : int):
+		"""Every paddle input goes through here so it lands in the replay log."""
+		paddle = self.paddleLeft if side == 'left' else self.paddleRight
+		paddle.direction = direction
+		self.replay.record(self.tick_count, side, direction)
+
+	def queue_input(self, side : str, direction : int, seq : int = None, tick : int = None):
+		"""
+		Client inputs wait for the next step instead of changing the paddle mid-tick,
+		the snapshots from that tick on acknowledge 'seq' so the client can reconcile
+		its predicted paddle. 'tick' is the server tick the client was looking at,
+		with rewind enabled a late input is applied there instead of now.
+		"""
+		self.pending_inputs.append((side, direction, seq, tick))
+
+	def reset_ack(self, side : str):
+		"""A rejoining client numbers its inputs from scratch, inputs of the old page are no longer acknowledged."""
+		self.pending_inputs = collections.deque(
+			(s, direction, None if s == side else seq, tick) for s, direction, seq, tick in self.pending_inputs)
+		self.input_acks[side] = 0
 
+	def enable_rewind(self, seconds : float = None):
+		"""Keeps the last 'seconds' (default engine max_rewind) of ticks so late inputs can be re-applied."""
+		seconds = GAME_SETTINGS['engine']['max_rewind'] if seconds is None else seconds
+		self.history = StateHistory(int(seconds * GAME_SETTINGS['engine']['tick_rate'])) if seconds > 0 else None
+
+	def apply_queued_inputs(self):
+		late = []
+		while self.pending_inputs:
+			side, direction, seq, tick = self.pending_inputs.popleft()
+			if self.history and tick is not None and tick < self.tick_count:
+				late.append((max(tick, self.history.oldest_tick), side, direction))
+			else:
+				self.set_direction(side, direction)
+				if self.history:
+					self.history.last.inputs.append((side, direction))
+			if seq is not None:
+				self.input_acks[side] = seq
+		if late:
+			self.rewind(late)
+
+	def rewind(self, late : list):
+		"""
+		Re-simulates the ticks since the oldest late input with every late input
+		applied at the tick its client saw (clamped to the history window). Inputs
+		already applied in the window are applied again at their tick, the replay
+		log is rewritten accordingly so replays stay exact.
+
+		A re-simulation that scores a point is undone and the late inputs are
+		applied now instead: points are only ever scored by the live tick.
+		"""
+		start = min(tick for tick, _, _ in late)
+		current = self.history.last # this step's entry, its inputs are already applied
+		saved = self.capture_state(), dict(self.replay.directions)
+		entries = self.history.rewind_to(start)
+		self.restore_state(entries[0].state)
+		self.replay.directions = {'left': self.paddleLeft.direction, 'right': self.paddleRight.direction}
+		recorded = []
+		while self.replay.inputs and self.replay.inputs[-1][0] >= start:
+			recorded.append(self.replay.inputs.pop())
+
+		for entry in entries:
+			replayed = self.history.push(entry.tick, self.capture_state())
+			for side, direction in entry.inputs + [(side, direction) for tick, side, direction in late if tick == entry.tick]:
+				self.set_direction(side, direction)
+				replayed.inputs.append((side, direction))
+			# step() simulates the current tick once we return
+			if entry is not current:
+				self.simulate_step()
+				if self.scoreBoard.events:
+					self.undo_rewind(start, entries, saved, recorded, late)
+					return
+		self.rewinds += 1
+		self.rewound_ticks += len(entries) - 1
+
+	def undo_rewind(self, start : int, entries : list, saved : tuple, recorded : list, late : list):
+		self.scoreBoard.events.clear()
+		self.restore_state(saved[0])
+		self.replay.directions = saved[1]
+		while self.replay.inputs and self.replay.inputs[-1][0] >= start:
+			self.replay.inputs.pop()
+		self.replay.inputs.extend(reversed(recorded))
+		self.history.rewind_to(start)
+		self.history.entries.extend(entries)
+		for _, side, direction in late:
+			self.set_direction(side, direction)
+			self.history.last.inputs.append((side, direction))
+		self.rewinds_refused += 1
+
+	def step(self):
+		if self.history is not None:
+			self.history.push(self.tick_count, self.capture_state())
+		if self.pending_inputs:
+			self.apply_queued_inputs()
+		self.simulate_step()
+
+	def simulate_step(self):
+		self.tick_count += 1
+		self.replay.ticks = self.tick_count
+		self.paddleLeft.update()
+		self.paddleRight.update()
+		self.ball.update(self.scoreBoard, self.player1, self.player2)
 		if self.mode == 'ai':
-			self.init_ai()
+			self.update_ai()
+
+
+	async def tick(self, steps : int = 1):
+		start = time.perf_counter()
+		await self.advance(steps)
+		self.metrics.tick(start, time.perf_counter(), steps)
 
-		while self.running:
-			await asyncio.sleep(1 / GAME_SETTINGS['display']['fps'])
 
-			if hasattr(self, 'game_id'):
-				if self.missing_players():
+	async def advance(self, steps : int):
+		if not self.consumers:
+			await self.end_game()
+			return
+
+		winner = None
+		for _ in range(steps):
+			self.step()
+			if self.scoreBoard.events:
+				winner = await self.handle_score_events()
+				if winner:
 					break
-				elif self.player_left():
-					continue
-			self.paddleLeft.update()
-			self.paddleRight.update()
-			self.ball.update(self.scoreBoard, self.player1, self.player2)
+		if self.tick_count >= self.next_send_tick:
+			self.next_send_tick = self.tick_count + self.send_interval
 			await self.broadcast_game_state()
 
-			if self.mode == 'ai':
-				self.update_ai()
+		if winner:
+			await self.finish(winner)
 
-			if (winner := self.scoreBoard.end_match()): # this could be done only when a point is scored
-				await self.scoreBoard.send()
-				await self.broadcast_game_end(winner)
-				await asyncio.sleep(0.1)
-				break
-			
-		await self.end_game()
+
+	async def handle_score_events(self) -> Player:
+		"""
+		Handles the point -> set -> match_end events of the last step once, in order,
+		and pushes the new score. Returns the match winner if the match just ended.
+		"""
+		winner = None
+		if self.history:
+			# a point that was already broadcast is never rewound
+			self.history.clear()
+		for event, player in self.scoreBoard.drain():
+			if event == 'set':
+				logger.debug(f"Set won by {player.player_id} ({self.player1.sets}-{self.player2.sets})")
+			elif event == 'match_end':
+				winner = player
+		await self.scoreBoard.send()
+		return winner
+
+
+	def attach(self):
+		"""Puts the game on the tick engine, see ShardedGame for games ticked elsewhere."""
+		tick_engine.register(self)
+
+	def detach(self):
+		tick_engine.unregister(self)
 
 
 	async def start(self):
 		self.running = True
 		await self.broadcast_game_start()
-		asyncio.create_task(self.game_loop())
+		self.ball.reset(self.scoreBoard, self.player1, self.player2)
+		if self.mode == 'ai':
+			self.init_ai()
+		self.attach()
+
+
+	async def finish(self, winner: Player):
+		# consumers close through their outbox, after game_end has been flushed
+		await self.broadcast_game_end(winner)
+		await self.end_game()
 
 
 	async def end_game(self):
 		self.running = False
+		self.detach()
 		for consumer in self.consumers:
-			await consumer.close()
+			await consumer.shutdown()
+		await self.spectators.shutdown()
 
-	def missing_players(self): # if we garuantee that we our players are always consumer[0] and consumer[1] we can check only for those positions
-		consumer_usernames = [c.get_username() for c in self.consumers]
-		if (self.player1.player_id not in consumer_usernames and 
-			self.player2.player_id not in consumer_usernames):
+	def missing_players(self):
+		if (self.player1.player_id not in self.presence and 
+			self.player2.player_id not in self.presence):
 			return (self.player1.player_id, self.player2.player_id)
 		return None
 	
 	def player_left(self): 
-		consumer_usernames = [c.get_username() for c in self.consumers]
-		if self.player1.player_id not in consumer_usernames:
+		if self.player1.player_id not in self.presence:
 			return self.player1.player_id
-		if self.player2.player_id not in consumer_usernames:
+		if self.player2.player_id not in self.presence:
 			return self.player2.player_id
 		return None	
 
@@ -120,24 +341,158 @@ class PongGame():
 	async def broadcast_game_start(self):
 		for consumer in self.consumers:
 			await consumer.broadcast_game_start(self)
+		self.spectators.broadcast({'event': 'game_start', 'state': self.get_start_data()})
 
 	async def broadcast_game_state(self):
+		start = time.perf_counter()
+		snapshot = GameSnapshot(self)
 		for consumer in self.consumers:
-			await consumer.broadcast_game_state(self)
+			await consumer.broadcast_game_state(snapshot)
+			self.frames_sent += 1
+		self.spectators.broadcast_game_state(snapshot)
+		self.metrics.send(time.perf_counter() - start)
+
+	@property
+	def frames_dropped(self) -> int:
+		return sum(c.outbox.dropped for c in self.consumers if c.outbox is not None)
 
 	async def broadcast_game_end(self, winner: Player):
 		for consumer in self.consumers:
 			await consumer.broadcast_game_end(winner)
+		self.spectators.broadcast({'event': 'game_end', 'state': {'winner': winner.player_id}})
 
 	async def broadcast_game_score(self, score_data: dict):
 		for consumer in self.consumers:
 			await consumer.broadcast_game_score(score_data)
+		self.spectators.broadcast(score_data)
 
 
 class MultiPongGame(PongGame):
-	def __init__(self, game_id):
-		super().__init__('vs') 
+	def __init__(self, game_id, seed : int = None):
+		super().__init__('vs', seed) 
 		self.game_id = game_id
+		self.player_uuids = (None, None)
+		self.suspended = False
+		self.grace_timer : TimerHandle = None
+		self.forfeit_winner : Player = None
+		self.enable_rewind()
+
+	def presence_changed(self):
+		"""
+		Presence is only re-evaluated when a consumer comes or goes. While a player is
+		away the game is taken off the tick engine entirely, it resumes on rejoin or
+		is forfeited to the player still present once the reconnect grace runs out.
+		"""
+		if not self.running:
+			return
+		if self.missing_players():
+			self.cancel_grace()
+			asyncio.create_task(self.end_game())
+		elif self.player_left():
+			self.suspend()
+		elif self.suspended:
+			self.resume()
+
+	def suspend(self):
+		if not self.suspended:
+			self.suspended = True
+			self.detach()
+			logger.info(f"Game {self.game_id} suspended, waiting for {self.player_left()}")
+		self.start_grace()
+
+	def start_grace(self):
+		if self.grace_timer is None:
+			self.grace_timer = timer_wheel.call_later(GAME_SETTINGS['match']['reconnect_grace'], self.grace_expired)
+
+	def resume(self):
+		self.suspended = False
+		self.cancel_grace()
+		self.metrics.last_tick = None # the pause is not jitter
+		self.attach()
+		logger.info(f"Game {self.game_id} resumed")
+
+	def cancel_grace(self):
+		if self.grace_timer:
+			self.grace_timer.cancel()
+			self.grace_timer = None
+
+	async def grace_expired(self):
+		self.grace_timer = None
+		if not self.running or not self.suspended:
+			return
+		if self.missing_players():
+			logger.info(f"Game {self.game_id} abandoned, nobody came back")
+			await self.end_game()
+			# no consumer is left to complete it, the match is dropped
+			score_buffer.forget(self.game_id)
+			await GameDB.delete_game(self.game_id)
+			return
+		absent = self.player_left()
+		self.forfeit_winner = self.player2 if absent == self.player1.player_id else self.player1
+		logger.info(f"Game {self.game_id} forfeited by {absent}")
+		await self.finish(self.forfeit_winner)
+
+	async def broadcast_game_score(self, score_data: dict):
+		await super().broadcast_game_score(score_data)
+		score_buffer.record(self.game_id, score_data['state']['player1_sets'], score_data['state']['player2_sets'])
+
+	def winner(self) -> Player:
+		return self.scoreBoard.end_match() or self.forfeit_winner
+
+	async def start(self):
+		await super().start()
+		checkpointer.track(self)
+
+	async def end_game(self):
+		self.suspended = False
+		self.cancel_grace()
+		checkpointer.untrack(self)
+		await super().end_game()
+		# however it ended (finished, forfeited, shard lost, drained), the game no longer needs this worker;
+		# off the tick, every other game would wait a Redis round trip otherwise
+		asyncio.create_task(registry.release('games', self.game_id))
+
+	def checkpoint(self) -> dict:
+		return {
+			'version': CHECKPOINT_VERSION,
+			'game_id': self.game_id,
+			'seed': self.seed,
+			'players': [(uuid, player.player_id) for uuid, player in zip(self.player_uuids, (self.player1, self.player2))],
+			'state': self.capture_state(),
+			'replay': self.replay.encode(),
+			'saved_at': time.time(),
+		}
+
+	@classmethod
+	def from_checkpoint(cls, data : dict) -> 'MultiPongGame':
+		"""
+		Rebuilds a game saved before a restart. It comes back running but suspended,
+		with no consumers: play resumes once both players have rejoined, or it is
+		forfeited (abandoned if nobody is back) when the reconnect grace runs out.
+		"""
+		game = cls(data['game_id'], data['seed'])
+		game.player_uuids = tuple(str(uuid) for uuid, _ in data['players'])
+		game.paddleLeft = Paddle(GAME_SETTINGS['l_paddle']['start_x'], GAME_SETTINGS['l_paddle']['start_y'])
+		game.paddleRight = Paddle(GAME_SETTINGS['r_paddle']['start_x'], GAME_SETTINGS['r_paddle']['start_y'])
+		game.ball = Ball(game.rng)
+		game.gamefield = GameField()
+		game.player1 = Player(data['players'][0][1], game.paddleLeft)
+		game.player2 = Player(data['players'][1][1], game.paddleRight)
+		game.scoreBoard = ScoreBoard(game, game.player1, game.player2)
+		game.restore_state(data['state'])
+		game.replay = ReplayRecorder.decode(data['replay'])
+		game.replay.ticks = game.tick_count
+		game.replay.directions = {'left': game.paddleLeft.direction, 'right': game.paddleRight.direction}
+		# nobody is holding a key after a reconnect
+		game.set_direction('left', 0)
+		game.set_direction('right', 0)
+		game.next_send_tick = game.tick_count
+		game.running = True
+		game.suspended = True
+		# the grace runs from the restore, a game nobody comes back to still ends
+		game.start_grace()
+		checkpointer.track(game)
+		return game
 
 	async def setup_players(self):
 		self.player1 = Player(self.consumers[0].get_username(), self.paddleLeft)
@@ -167,4 +522,4 @@ class AiPongGame(PongGame):
 	def update_ai(self):
 		output1 = self.net1.activate((self.paddleRight.y, self.ball.y, abs(self.paddleRight.x - self.ball.x)))
 		decision1 = output1.index(max(output1))
-		self.paddleRight.direction = 0 if decision1 == 0 else (-1 if decision1 == 1 else 1)		
\ No newline at end of file
+		self.set_direction('right', 0 if decision1 == 0 else (-1 if decision1 == 1 else 1))		
\ No newline at end of file
@@ -1,4 +1,4 @@
-import json, asyncio, random, math
+import random, math, os
 
 GAME_SETTINGS = {
 	'field': {
@@ -26,13 +26,70 @@ GAME_SETTINGS = {
 	},
 	'match': {
 		'win_points': 3,
-		'win_sets': 2
+		'win_sets': 2,
+		'reconnect_grace': 30 # seconds a multiplayer game waits for a player to rejoin before forfeiting
 	},
 	'display': {
-		'fps': 60
+		'fps': 60 # reference rate velocities are expressed in (px per frame)
+	},
+	'engine': {
+		'tick_rate': 120,
+		'send_rate': 30,
+		'max_catchup': 5,
+		'shards': 0, # worker processes running multiplayer games, 0 keeps them in the web process
+		'shard_load_interval': 1,
+		'max_rewind': 0.2 # seconds a late multiplayer input can be applied in the past
+	},
+	'network': {
+		'send_queue': 8, # frames a socket may have queued before stale ones are dropped
+		'send_queue_hard': 64 # queued events (frames can always be dropped) before a stalled socket is closed
+	},
+	'persistence': {
+		'flush_interval': 5, # seconds between batched score writes
+		# runtime files (journal, checkpoints), kept out of the source tree
+		'data_dir': os.environ.get('PONG_DATA_DIR') or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'var', 'pong'),
+		'score_journal': 'scores.journal', # in data_dir
+		'completion_window': 0.1, # seconds completions are held to share one transaction
+		'checkpoint_interval': 2, # seconds between live game snapshots
+		'checkpoint_max_age': 600, # older checkpoints are not restored
+		'checkpoint_dir': 'checkpoints' # in data_dir
+	},
+	'drain': {
+		'timeout': 600, # seconds in-flight games get before the worker exits anyway
+		'retry_after': 30, # hint sent to lobby clients turned away while draining
+		'poll_interval': 5
+	},
+	'timers': {
+		'resolution': 0.05, # seconds per slot of the finest timer wheel
+		'slots': 64,
+		'levels': 4
+	},
+	'spectate': {
+		'max_per_game': 500,
+		'send_rate': 15
+	},
+	'replay': {
+		'speeds': (1, 2, 8),
+		'keyframe_interval': 5 # seconds of match time between seek keyframes
+	},
+	'latency': {
+		'probe_interval': 2, # seconds between RTT pings on a game socket
+		'rtt_high': 150, # ms, above this (srtt + 4 * jitter) a socket gets fewer frames
+		'rtt_low': 80, # ms, below this the frame rate is restored step by step
+		'recover_probes': 3,
+		'max_divisor': 4 # a congested socket still gets at least 1 in max_divisor frames
+	},
+	'cluster': {
+		'lease_ttl': 15, # seconds a dead worker keeps its games, lobby and online entries
+		'moved_retry': 2, # seconds a client waits before reconnecting to a game owned by another worker
+		'moved_max_retries': 5, # reconnects a client tries before giving up on a game it cannot reach
+		'match_ttl': 60 # seconds a lobby match lets its two players claim the new game
 	},
 }
 
+# fraction of a reference frame simulated by one engine step
+STEP_SCALE = GAME_SETTINGS['display']['fps'] / GAME_SETTINGS['engine']['tick_rate']
+
 
 class Player:
 	def __init__(self, username, paddle):
@@ -59,11 +116,25 @@ class ScoreBoard:
 		self.left_player = left_player
 		self.right_player = right_player
 		self.last_scored = None
+		self.events = [] # (event, player) in the order they happened, drained by the game tick
 
-	def update(self, last_scored: Player = None):
-		self.last_scored = last_scored
-		if last_scored:
-			asyncio.create_task(self.send())
+	def point(self, scorer: Player):
+		"""
+		Ball went out: a point event, which may complete a set (set event)
+		which may in turn complete the match (match_end event).
+		"""
+		scorer.score_point()
+		self.last_scored = scorer
+		self.events.append(('point', scorer))
+		if scorer.score >= GAME_SETTINGS['match']['win_points']:
+			self.new_set(scorer)
+			self.events.append(('set', scorer))
+			if scorer.sets >= GAME_SETTINGS['match']['win_sets']:
+				self.events.append(('match_end', scorer))
+
+	def drain(self) -> list:
+		events, self.events = self.events, []
+		return events
 
 	def new_set(self, winner : Player):
 		winner.win_set()
@@ -106,36 +177,41 @@ class Paddle:
 		self.y = max(0, min(GAME_SETTINGS['field']['height'] - GAME_SETTINGS['paddle']['height'], y))
 
 	def update(self):
-		self.y += self.direction * GAME_SETTINGS['paddle']['velo']
+		self.y += self.direction * GAME_SETTINGS['paddle']['velo'] * STEP_SCALE
 		self.move(self.y)
 
 
 class Ball:
-	def __init__(self):
+	MAX_CONTACTS = 4 # wall/paddle contacts resolved per step
+
+	def __init__(self, rng : random.Random = None):
+		self.rng = rng or random.Random()
 		self.x = GAME_SETTINGS['ball']['start_x']
 		self.y = GAME_SETTINGS['ball']['start_y']
 		self.size = GAME_SETTINGS['ball']['size']
 		self.velo = GAME_SETTINGS['ball']['velo']
 		self.dx = 0
 		self.dy = 0
-		self.wait_time = None
-		self.is_waiting = False
+		self.wait_ticks = 0 # serve countdown, counted in engine steps so it also runs headless
+		self.draws = 0 # bumped whenever the ball draws from rng, see PongGame.rng_snapshot()
+		self.carry = 0.0 # part of a step left over after MAX_CONTACTS, travelled on the next one
 
 	def _get_random_angle(self, min_angle, max_angle, excluded_angles):
 		"""Return a random angle (in radians) between min_angle & max_angle,
 		excluding anything in 'excluded_angles' (in degrees)."""
+		self.draws += 1
 		angle_in_degrees = 0
 		while angle_in_degrees in excluded_angles:
-			angle_in_degrees = random.randrange(min_angle, max_angle)
+			angle_in_degrees = self.rng.randrange(min_angle, max_angle)
 		return math.radians(angle_in_degrees)
 
-	async def countdown(self, duration):
-		await asyncio.sleep(duration)
-		self.is_waiting = False
+	@property
+	def is_waiting(self) -> bool:
+		return self.wait_ticks > 0
 
 	def coin_toss(self):
 		angle = self._get_random_angle(-35, 35, [0])
-		pos = 1 if random.random() < 0.5 else -1
+		pos = 1 if self.rng.random() < 0.5 else -1
 		self.dx = pos * abs(math.cos(angle))
 		self.dy = math.sin(angle)
 
@@ -146,10 +222,11 @@ class Ball:
 		self.x = GAME_SETTINGS['ball']['start_x']
 		self.y = GAME_SETTINGS['ball']['start_y']
 		self.velo = GAME_SETTINGS['ball']['velo']
+		self.carry = 0.0
 		angle = self._get_random_angle(-35, 35, [0])
 
 		if scoreBoard.last_scored is None:
-			pos = 1 if random.random() < 0.5 else -1
+			pos = 1 if self.rng.random() < 0.5 else -1
 			self.dx = pos * abs(math.cos(angle))
 		else:
 			if scoreBoard.last_scored == rightPlayer:
@@ -158,68 +235,91 @@ class Ball:
 				self.dx = -abs(math.cos(angle))
 
 		self.dy = math.sin(angle)
-		self.is_waiting = True
+		self.wait_ticks = 3 * GAME_SETTINGS['engine']['tick_rate']
 		leftPlayer.paddle.reset()
 		rightPlayer.paddle.reset()
-		asyncio.create_task(self.countdown(3))
+
+	def _wall_impact(self, vy, remaining):
+		"""Fraction of the step at which the ball reaches the top or bottom boundary, or None."""
+		if vy < 0:
+			t = (self.size - self.y) / vy
+		elif vy > 0:
+			t = (GAME_SETTINGS['field']['height'] - self.size - self.y) / vy
+		else:
+			return None
+		t = max(0.0, t)
+		return t if t <= remaining else None
+
+	def _paddle_impact(self, paddle : Paddle, vx, vy, remaining):
+		"""Fraction of the step at which the ball's leading edge reaches the paddle face, or None."""
+		if vx < 0:
+			if self.x + self.size < paddle.x: # already behind the paddle
+				return None
+			t = max(0.0, (paddle.x + paddle.width - self.x) / vx)
+		elif vx > 0:
+			if self.x > paddle.x + paddle.width:
+				return None
+			t = max(0.0, (paddle.x - self.x - self.size) / vx)
+		else:
+			return None
+		if t > remaining:
+			return None
+		y = self.y + vy * t
+		if y + self.size >= paddle.y and y <= paddle.y + paddle.height:
+			return t
+		return None
+
+	def _bounce(self, paddle : Paddle, direction : int):
+		paddle_center = paddle.y + paddle.height / 2
+		offset = (self.y + self.size / 2) - paddle_center
+		normalized = offset / (paddle.height / 2)
+		self.draws += 1
+		angle = normalized * math.radians(60) + self.rng.uniform(-0.15, 0.15)
+		self.dx = direction * abs(math.cos(angle))
+		self.dy = math.sin(angle)
+		self.velo += 0.3
+		self.x = paddle.x + paddle.width if direction > 0 else paddle.x - self.size
 
 	def update(self, scoreBoard : ScoreBoard, leftPlayer : Player, rightPlayer : Player):
 		if self.is_waiting:
+			self.wait_ticks -= 1
 			return
 
-		self.x += self.velo * self.dx
-		self.y += self.velo * self.dy
-
-		if self.y <= self.size and self.dy < 0:
-			self.dy *= -1
-		
-		if self.y >= GAME_SETTINGS['field']['height'] - self.size and self.dy > 0:
-			self.dy *= -1
-
-
-		if (self.x <= leftPlayer.paddle.x + leftPlayer.paddle.width and
-			self.x + self.size >= leftPlayer.paddle.x and
-			self.y + self.size >= leftPlayer.paddle.y and
-			self.y <= leftPlayer.paddle.y + leftPlayer.paddle.height):
-			paddle_center = leftPlayer.paddle.y + leftPlayer.paddle.height / 2
-			offset = (self.y + self.size / 2) - paddle_center
-			normalized = offset / (leftPlayer.paddle.height / 2)
-			angle = normalized * math.radians(60) + random.uniform(-0.15, 0.15)
-			self.dx = abs(math.cos(angle))
-			self.dy = math.sin(angle)
-			self.velo += 0.3
-			self.x = leftPlayer.paddle.x + leftPlayer.paddle.width
-
-		if (self.x + self.size >= rightPlayer.paddle.x and
-			self.y + self.size >= rightPlayer.paddle.y and
-			self.y <= rightPlayer.paddle.y + rightPlayer.paddle.height):
-			paddle_center = rightPlayer.paddle.y + rightPlayer.paddle.height / 2
-			offset = (self.y + self.size / 2) - paddle_center
-			normalized = offset / (rightPlayer.paddle.height / 2)
-			angle = normalized * math.radians(60) + random.uniform(-0.15, 0.15)
-			self.dx = -abs(math.cos(angle))
-			self.dy = math.sin(angle)
-			self.velo += 0.3
-			self.x = rightPlayer.paddle.x - self.size
+		# swept collision: move to the earliest wall/paddle contact within the step,
+		# respond, then spend the rest of the step with the new velocity
+		remaining = 1.0 + self.carry
+		self.carry = 0.0
+		for _ in range(self.MAX_CONTACTS):
+			vx = self.velo * self.dx * STEP_SCALE
+			vy = self.velo * self.dy * STEP_SCALE
+			paddle = leftPlayer.paddle if vx < 0 else rightPlayer.paddle
+			t_wall = self._wall_impact(vy, remaining)
+			t_paddle = self._paddle_impact(paddle, vx, vy, remaining)
+
+			if t_wall is None and t_paddle is None:
+				self.x += vx * remaining
+				self.y += vy * remaining
+				break
+
+			t = min(t for t in (t_wall, t_paddle) if t is not None)
+			self.x += vx * t
+			self.y += vy * t
+			remaining -= t
+			if t_paddle is not None and t_paddle <= t:
+				self._bounce(paddle, 1 if paddle is leftPlayer.paddle else -1)
+			else:
+				self.dy *= -1
+		else:
+			# out of contacts for this step, the ball keeps the distance it has not travelled yet
+			self.carry = remaining
 
 		if self.x <= 0:
-			rightPlayer.score_point()
-			if rightPlayer.score >= GAME_SETTINGS['match']['win_points']:
-				scoreBoard.update(rightPlayer)
-				scoreBoard.new_set(rightPlayer)
-			else:
-				scoreBoard.update(rightPlayer)
+			scoreBoard.point(rightPlayer)
 			self.reset(scoreBoard, leftPlayer, rightPlayer)
 
 		elif self.x >= GAME_SETTINGS['field']['width']:
-			leftPlayer.score_point()
-			if leftPlayer.score >= GAME_SETTINGS['match']['win_points']:
-				scoreBoard.update(leftPlayer)
-				scoreBoard.new_set(leftPlayer)
-			else:
-				scoreBoard.update(leftPlayer)
+			scoreBoard.point(leftPlayer)
 			self.reset(scoreBoard, leftPlayer, rightPlayer)
-		scoreBoard.update()
 
 
 class AIPlayer(Player):
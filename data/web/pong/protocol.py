@@ -0,0 +1,70 @@
+import struct, json, time
+
+# binary frame types, first byte of every binary message
+GAME_STATE = 1
+
+# type, tick, server time (ms), ball_x, ball_y, l_paddle_y, r_paddle_y, l_ack, r_ack
+GAME_STATE_FRAME = struct.Struct('<BIdffffII')
+
+
+def encode_game_state(game, timestamp : float) -> bytes:
+	"""Packs the per-frame game_state into a fixed-layout little-endian frame (see decodeGameState in SinglePongGame.js)."""
+	return GAME_STATE_FRAME.pack(
+		GAME_STATE,
+		game.tick_count & 0xFFFFFFFF,
+		timestamp,
+		game.ball.x,
+		game.ball.y,
+		game.paddleLeft.y,
+		game.paddleRight.y,
+		game.input_acks['left'] & 0xFFFFFFFF,
+		game.input_acks['right'] & 0xFFFFFFFF,
+	)
+
+
+# snapshots actually encoded in this process, by format, with their total size;
+# a snapshot shared by N consumers is counted once (see PongGame.serializations)
+serialization_stats = {
+	'json': 0,
+	'binary': 0,
+	'bytes': 0,
+}
+
+
+class GameSnapshot:
+	"""
+	The game_state of a single tick, encoded lazily at most once per format
+	and shared by every consumer of the game.
+	"""
+	def __init__(self, game):
+		self.game = game
+		self.tick = game.tick_count
+		self.time = time.time() * 1000
+		self._text : str = None
+		self._binary : bytes = None
+
+	def _count(self, fmt : str, size : int):
+		serialization_stats[fmt] += 1
+		serialization_stats['bytes'] += size
+		self.game.serializations += 1
+
+	@property
+	def text(self) -> str:
+		if self._text is None:
+			self._text = json.dumps({
+				'event': 'game_state',
+				'state': {
+					'tick': self.tick,
+					'time': self.time,
+					**self.game.get_state_data()
+				}
+			})
+			self._count('json', len(self._text))
+		return self._text
+
+	@property
+	def binary(self) -> bytes:
+		if self._binary is None:
+			self._binary = encode_game_state(self.game, self.time)
+			self._count('binary', len(self._binary))
+		return self._binary
@@ -0,0 +1,216 @@
+from .pong_components import GAME_SETTINGS
+from .timers import timer_wheel
+import collections, json, os, socket, time, logging
+
+logger = logging.getLogger('pong')
+
+
+class LocalBackend:
+	"""In-process tables, the default: only correct with a single ASGI worker."""
+	def __init__(self):
+		self.tables = collections.defaultdict(dict) # table -> key -> (value, expires or None)
+
+	def _entry(self, table : str, key : str):
+		entry = self.tables[table].get(key)
+		if entry and entry[1] is not None and entry[1] <= time.monotonic():
+			del self.tables[table][key]
+			return None
+		return entry
+
+	def _expires(self, ttl : float):
+		return time.monotonic() + ttl if ttl else None
+
+	async def get(self, table : str, key : str):
+		entry = self._entry(table, key)
+		return entry[0] if entry else None
+
+	async def set(self, table : str, key : str, value, ttl : float = None):
+		self.tables[table][key] = (value, self._expires(ttl))
+
+	async def claim(self, table : str, key : str, value, ttl : float = None) -> bool:
+		if self._entry(table, key):
+			return False
+		self.tables[table][key] = (value, self._expires(ttl))
+		return True
+
+	async def refresh(self, table : str, key : str, value, ttl : float) -> bool:
+		entry = self._entry(table, key)
+		if not entry or entry[0] != value:
+			return False
+		self.tables[table][key] = (value, self._expires(ttl))
+		return True
+
+	async def delete(self, table : str, key : str, value=None) -> bool:
+		entry = self._entry(table, key)
+		if not entry or (value is not None and entry[0] != value):
+			return False
+		del self.tables[table][key]
+		return True
+
+	async def items(self, table : str) -> dict:
+		return {key: entry[0] for key in list(self.tables[table]) if (entry := self._entry(table, key))}
+
+
+class RedisBackend:
+	"""
+	Tables shared by every worker through Redis (or anything speaking its protocol),
+	one key per entry: pong:<table>:<key> holding the JSON encoded value.
+	"""
+	# compare-and-delete / compare-and-expire, so a worker never drops an entry somebody else took over
+	DELETE_IF = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+	EXPIRE_IF = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0"
+
+	def __init__(self, client):
+		self.client = client
+
+	@classmethod
+	def from_url(cls, url : str) -> 'RedisBackend':
+		# optional dependency, only needed once the registry is configured to use it
+		import redis.asyncio
+		return cls(redis.asyncio.from_url(url, decode_responses=True))
+
+	def _key(self, table : str, key : str) -> str:
+		return f'pong:{table}:{key}'
+
+	def _ms(self, ttl : float):
+		return int(ttl * 1000) if ttl else None
+
+	async def get(self, table : str, key : str):
+		value = await self.client.get(self._key(table, key))
+		return json.loads(value) if value is not None else None
+
+	async def set(self, table : str, key : str, value, ttl : float = None):
+		await self.client.set(self._key(table, key), json.dumps(value), px=self._ms(ttl))
+
+	async def claim(self, table : str, key : str, value, ttl : float = None) -> bool:
+		return bool(await self.client.set(self._key(table, key), json.dumps(value), px=self._ms(ttl), nx=True))
+
+	async def refresh(self, table : str, key : str, value, ttl : float) -> bool:
+		return bool(await self.client.eval(self.EXPIRE_IF, 1, self._key(table, key), json.dumps(value), self._ms(ttl)))
+
+	async def delete(self, table : str, key : str, value=None) -> bool:
+		if value is None:
+			return bool(await self.client.delete(self._key(table, key)))
+		return bool(await self.client.eval(self.DELETE_IF, 1, self._key(table, key), json.dumps(value)))
+
+	async def items(self, table : str) -> dict:
+		prefix = self._key(table, '')
+		keys = [key async for key in self.client.scan_iter(match=prefix + '*')]
+		if not keys:
+			return {}
+		values = await self.client.mget(keys)
+		return {key[len(prefix):]: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+
+class Registry:
+	"""
+	Shared state of the live game tier: who owns a game, who waits in a lobby,
+	who is online. Live objects (games, sockets) stay in the worker that owns
+	them, the registry only says which worker that is.
+
+	Ownership is a lease: acquire() claims a key for 'lease_ttl' seconds and the
+	registry keeps renewing every key it holds until release(), so the keys of a
+	worker that died free themselves. A key acquired with handoff=True is expected
+	to be removed by another worker (a lobby entry taken by a match), failing to
+	renew it is not counted as a lost lease.
+	"""
+	def __init__(self, worker_id : str, lease_ttl : float, backend=None):
+		self.worker_id = worker_id
+		self.lease_ttl = lease_ttl
+		self._backend = backend
+		self.leases = {} # (table, key) -> value we hold it with
+		self.handoffs = set() # (table, key) other workers may remove
+		self.timer = None
+		self.lost = 0
+
+	@property
+	def backend(self):
+		if self._backend is None:
+			from django.conf import settings
+			url = getattr(settings, 'REDIS_URL', None)
+			self._backend = RedisBackend.from_url(url) if url else LocalBackend()
+			logger.info(f"Pong registry: {type(self._backend).__name__}, worker {self.worker_id}")
+		return self._backend
+
+	async def get(self, table : str, key : str):
+		return await self.backend.get(table, key)
+
+	async def set(self, table : str, key : str, value, ttl : float = None):
+		await self.backend.set(table, key, value, ttl)
+
+	async def delete(self, table : str, key : str, value=None) -> bool:
+		return await self.backend.delete(table, key, value)
+
+	async def items(self, table : str) -> dict:
+		return await self.backend.items(table)
+
+	async def count(self, table : str) -> int:
+		return len(await self.backend.items(table))
+
+	async def acquire(self, table : str, key : str, value=None, handoff : bool = False):
+		"""Leases 'key' to 'value' (default: this worker), returns whoever holds it afterwards."""
+		value = self.worker_id if value is None else value
+		if (table, key) in self.leases:
+			return self.leases[(table, key)]
+		for _ in range(2):
+			if await self.backend.claim(table, key, value, self.lease_ttl):
+				self.leases[(table, key)] = value
+				if handoff:
+					self.handoffs.add((table, key))
+				if self.timer is None:
+					self.timer = timer_wheel.call_later(self.lease_ttl / 3, self.renew)
+				return value
+			if (owner := await self.backend.get(table, key)) is not None:
+				return owner
+			# expired between the two calls, try again
+		return None
+
+	async def release(self, table : str, key : str):
+		self.handoffs.discard((table, key))
+		if (value := self.leases.pop((table, key), None)) is not None:
+			await self.backend.delete(table, key, value)
+
+	def forget(self, table : str, key : str):
+		"""Stops renewing a lease somebody else already removed (e.g. a matched lobby entry)."""
+		self.handoffs.discard((table, key))
+		self.leases.pop((table, key), None)
+
+	async def release_all(self):
+		for table, key in list(self.leases):
+			await self.release(table, key)
+
+	def holds(self, table : str, key : str, value=None) -> bool:
+		value = self.worker_id if value is None else value
+		return self.leases.get((table, key)) == value
+
+	async def renew(self):
+		self.timer = None
+		for (table, key), value in list(self.leases.items()):
+			try:
+				renewed = await self.backend.refresh(table, key, value, self.lease_ttl)
+			except Exception as e:
+				logger.error(f"Error renewing lease {table}:{key}: {e}")
+				continue
+			if renewed or self.leases.pop((table, key), None) is None:
+				continue
+			if (table, key) in self.handoffs:
+				self.handoffs.discard((table, key))
+			else:
+				self.lost += 1
+				logger.warning(f"Lost lease {table}:{key}")
+		if self.leases and self.timer is None:
+			self.timer = timer_wheel.call_later(self.lease_ttl / 3, self.renew)
+
+	def stats(self) -> dict:
+		return {
+			'worker_id': self.worker_id,
+			'backend': type(self._backend).__name__ if self._backend else None,
+			'leases': len(self.leases),
+			'lost': self.lost,
+		}
+
+
+registry = Registry(
+	os.environ.get('PONG_WORKER_ID') or f'{socket.gethostname()}:{os.getpid()}',
+	GAME_SETTINGS['cluster']['lease_ttl'],
+)
@@ -0,0 +1,69 @@
+import struct, zlib
+
+REPLAY_VERSION = 1
+
+# version, seed, final tick, input count
+REPLAY_HEADER = struct.Struct('<BIII')
+# tick, packed side/direction: bit 2 is the side (0 left, 1 right), bits 0-1 are direction + 1
+REPLAY_INPUT = struct.Struct('<IB')
+
+SIDES = ('left', 'right')
+
+
+class ReplayRecorder:
+	"""
+	Compact replay of a match: the RNG seed plus a tick-indexed log of paddle
+	direction changes. Together with the deterministic engine this is enough to
+	re-simulate the whole match (see simulate()).
+	"""
+	def __init__(self, seed : int):
+		self.seed = seed
+		self.ticks = 0
+		self.inputs = []
+		self.directions = {'left': 0, 'right': 0}
+
+	def record(self, tick : int, side : str, direction : int):
+		if self.directions[side] == direction:
+			return
+		self.directions[side] = direction
+		self.inputs.append((tick, side, direction))
+
+	def encode(self) -> bytes:
+		data = bytearray(REPLAY_HEADER.pack(REPLAY_VERSION, self.seed, self.ticks, len(self.inputs)))
+		for tick, side, direction in self.inputs:
+			data += REPLAY_INPUT.pack(tick, (SIDES.index(side) << 2) | (direction + 1))
+		return zlib.compress(bytes(data))
+
+	@classmethod
+	def decode(cls, blob : bytes) -> 'ReplayRecorder':
+		data = zlib.decompress(bytes(blob))
+		version, seed, ticks, count = REPLAY_HEADER.unpack_from(data)
+		if version != REPLAY_VERSION:
+			raise ValueError(f"Unsupported replay version {version}")
+		replay = cls(seed)
+		replay.ticks = ticks
+		for tick, packed in REPLAY_INPUT.iter_unpack(data[REPLAY_HEADER.size:REPLAY_HEADER.size + count * REPLAY_INPUT.size]):
+			replay.inputs.append((tick, SIDES[packed >> 2], (packed & 3) - 1))
+		return replay
+
+	def script(self, side : str) -> dict:
+		return {tick: direction for tick, s, direction in self.inputs if s == side}
+
+
+def replay_game(blob : bytes, player_ids=('player1', 'player2')):
+	"""Builds a HeadlessPongGame that will replay the recorded match when run."""
+	from .headless import HeadlessPongGame, scripted
+	replay = ReplayRecorder.decode(blob)
+	game = HeadlessPongGame(
+		scripted(replay.script('left')),
+		scripted(replay.script('right')),
+		player_ids,
+		seed=replay.seed,
+	)
+	return game, replay
+
+
+def simulate(blob : bytes, player_ids=('player1', 'player2')) -> dict:
+	"""Re-simulates a recorded match headlessly and returns the final scoreboard."""
+	game, replay = replay_game(blob, player_ids)
+	return game.run(max_ticks=replay.ticks)
@@ -1,5 +1,5 @@
 from django.urls import path
-from .consumers import SinglePongConsumer, MultiPongConsumer, AIConsumer
+from .consumers import SinglePongConsumer, MultiPongConsumer, AIConsumer, SpectatorConsumer, ReplayConsumer
 from .lobby import QuickLobby, TournamentLobby
 
 pong_websocket_urlpatterns = [
@@ -7,5 +7,7 @@ pong_websocket_urlpatterns = [
     path('wss/mpong/', QuickLobby.as_asgi()),
 	path('wss/mpong/tournament/<str:game_id>/', TournamentLobby.as_asgi()),
 	path('wss/mpong/game/<str:game_id>/', MultiPongConsumer.as_asgi()),
+	path('wss/mpong/watch/<str:game_id>/', SpectatorConsumer.as_asgi()),
+	path('wss/mpong/replay/<str:game_id>/', ReplayConsumer.as_asgi()),
 	path('wss/aipong/', AIConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -0,0 +1,156 @@
+from .pong_components import GAME_SETTINGS
+from .timers import timer_wheel
+from .models import OngoingGame
+from channels.db import database_sync_to_async
+from django.db.models import Case, When, Value
+import asyncio, json, os, logging
+
+logger = logging.getLogger('pong')
+
+
+class ScoreBuffer:
+	"""
+	Write-behind store for OngoingGame sets. record() only keeps the latest sets
+	per game_id and appends them to a journal, a flush (every flush_interval
+	seconds while anything is dirty, or on demand at match end) writes every
+	dirty game with a single UPDATE. After a crash the journal is replayed on
+	first use so the last recorded sets still reach the database.
+
+	Journal appends and compactions run in a worker thread, one at a time
+	(journal_lock), so record() never touches the disk from the game tick.
+	"""
+	def __init__(self, journal_path : str, interval : float):
+		self.journal_path = journal_path
+		self.interval = interval
+		self.dirty = {} # game_id -> (player1_sets, player2_sets)
+		self.latest = {} # last recorded sets per live game, most score updates leave them unchanged
+		self.journal = None
+		self.unjournaled = [] # recorded entries waiting for the journal writer
+		self.journal_writer : asyncio.Task = None
+		self.journal_lock : asyncio.Lock = None
+		self.timer = None
+		self.lock : asyncio.Lock = None
+		self.recovered = False
+		self.records = 0
+		self.flushes = 0
+		self.rows = 0
+
+	def recover(self):
+		self.recovered = True
+		if not os.path.exists(self.journal_path):
+			return
+		try:
+			with open(self.journal_path) as f:
+				for line in f:
+					game_id, player1_sets, player2_sets = json.loads(line)
+					self.dirty[game_id] = (player1_sets, player2_sets)
+		except (OSError, ValueError) as e:
+			logger.error(f"Error reading score journal {self.journal_path}: {e}")
+		if self.dirty:
+			logger.info(f"Recovered {len(self.dirty)} unflushed scores from {self.journal_path}")
+
+	def append_journal(self, entries : list):
+		try:
+			if self.journal is None:
+				os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+				self.journal = open(self.journal_path, 'a')
+			self.journal.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+			self.journal.flush()
+		except OSError as e:
+			logger.error(f"Error writing score journal {self.journal_path}: {e}")
+
+	def compact_journal(self, dirty : dict):
+		"""Rewrites the journal with only what is still unflushed."""
+		if self.journal is not None:
+			self.journal.close()
+			self.journal = None
+		try:
+			if not dirty:
+				if os.path.exists(self.journal_path):
+					os.remove(self.journal_path)
+				return
+			tmp = self.journal_path + '.tmp'
+			with open(tmp, 'w') as f:
+				for game_id, (player1_sets, player2_sets) in dirty.items():
+					f.write(json.dumps((game_id, player1_sets, player2_sets)) + '\n')
+			os.replace(tmp, self.journal_path)
+		except OSError as e:
+			logger.error(f"Error compacting score journal {self.journal_path}: {e}")
+
+	async def write_journal(self):
+		if self.journal_lock is None:
+			self.journal_lock = asyncio.Lock()
+		async with self.journal_lock:
+			while self.unjournaled:
+				entries, self.unjournaled = self.unjournaled, []
+				await asyncio.to_thread(self.append_journal, entries)
+		self.journal_writer = None
+
+	def record(self, game_id : str, player1_sets : int, player2_sets : int):
+		if not self.recovered:
+			self.recover()
+		if self.latest.get(game_id) == (player1_sets, player2_sets):
+			return
+		self.latest[game_id] = self.dirty[game_id] = (player1_sets, player2_sets)
+		self.records += 1
+		self.unjournaled.append((game_id, player1_sets, player2_sets))
+		if self.journal_writer is None:
+			self.journal_writer = asyncio.create_task(self.write_journal())
+		if self.timer is None:
+			self.timer = timer_wheel.call_later(self.interval, self.flush)
+
+	def forget(self, game_id : str):
+		"""Drops a finished game, call after its final sets were flushed."""
+		self.latest.pop(game_id, None)
+		self.dirty.pop(game_id, None)
+
+
+	async def flush(self):
+		if not self.recovered:
+			self.recover()
+		if self.lock is None:
+			self.lock = asyncio.Lock()
+		async with self.lock:
+			if self.timer is not None:
+				self.timer.cancel()
+				self.timer = None
+			if not self.dirty:
+				return
+			batch, self.dirty = self.dirty, {}
+			try:
+				rows = await database_sync_to_async(self.write)(batch)
+			except Exception as e:
+				logger.error(f"Error flushing {len(batch)} scores: {e}")
+				# keep whatever was not superseded while we were writing
+				self.dirty = {**batch, **self.dirty}
+				if self.timer is None:
+					self.timer = timer_wheel.call_later(self.interval, self.flush)
+				return
+			self.flushes += 1
+			self.rows += rows
+			if self.journal_lock is None:
+				self.journal_lock = asyncio.Lock()
+			# appends still queued wait for the compaction and land after it
+			async with self.journal_lock:
+				await asyncio.to_thread(self.compact_journal, dict(self.dirty))
+
+	@staticmethod
+	def write(batch : dict) -> int:
+		return OngoingGame.objects.filter(game_id__in=list(batch)).update(
+			player1_sets=Case(*[When(game_id=game_id, then=Value(sets[0])) for game_id, sets in batch.items()]),
+			player2_sets=Case(*[When(game_id=game_id, then=Value(sets[1])) for game_id, sets in batch.items()]),
+		)
+
+	def stats(self) -> dict:
+		return {
+			'dirty': len(self.dirty),
+			'records': self.records,
+			'flushes': self.flushes,
+			'rows': self.rows,
+		}
+
+
+score_buffer = ScoreBuffer(
+	os.path.join(GAME_SETTINGS['persistence']['data_dir'], GAME_SETTINGS['persistence']['score_journal']),
+	GAME_SETTINGS['persistence']['flush_interval'],
+)
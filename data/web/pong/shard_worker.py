@@ -0,0 +1,138 @@
+"""
+Worker side of the sharded engine (see shards.py). Imported by spawned worker
+processes, so nothing that needs Django may be imported at module level.
+"""
+import asyncio, os, time, logging
+
+logger = logging.getLogger('pong')
+
+
+class ShardRelay:
+	"""
+	Stands in for the websocket consumers of a game running on a worker: every
+	broadcast goes back to the parent process over the pipe as a small tuple.
+	"""
+	def __init__(self, worker, game_id : str):
+		self.worker = worker
+		self.game_id = game_id
+		self.outbox = None
+		self.sent_tick = 0
+		self.ack_epochs = {'left': 0, 'right': 0} # last reset_ack() from the parent, per side
+
+	def get_username(self):
+		return None
+
+	async def broadcast_game_start(self, game):
+		pass
+
+	async def broadcast_game_state(self, snapshot):
+		game = snapshot.game
+		# the replay tail a rewind may have rewritten since the last frame, so the parent's log stays in step
+		window = game.history.entries.maxlen if game.history is not None else 0
+		from_tick = max(0, self.sent_tick + 1 - window)
+		inputs = []
+		for entry in reversed(game.replay.inputs):
+			if entry[0] < from_tick:
+				break
+			inputs.append(entry)
+		inputs.reverse()
+		self.sent_tick = snapshot.tick
+		self.worker.send(('state', self.game_id, snapshot.tick,
+			game.ball.x, game.ball.y, game.paddleLeft.y, game.paddleRight.y, from_tick, inputs,
+			dict(game.input_acks), dict(self.ack_epochs)))
+
+	async def broadcast_game_score(self, score_data : dict):
+		self.worker.send(('score', self.game_id, score_data['state']))
+
+	async def broadcast_game_end(self, winner):
+		game = self.worker.games[self.game_id]
+		self.worker.send(('end', self.game_id, 'left' if winner is game.player1 else 'right', game.replay.encode()))
+
+	async def shutdown(self):
+		self.worker.games.pop(self.game_id, None)
+
+
+class ShardWorker:
+	def __init__(self, conn, shard_id : int):
+		self.conn = conn
+		self.shard_id = shard_id
+		self.games = {}
+		self.stopped : asyncio.Event = None
+
+	def send(self, message : tuple):
+		try:
+			self.conn.send(message)
+		except (BrokenPipeError, EOFError, OSError):
+			self.stopped.set()
+
+	async def create(self, game_id : str, seed : int, player_ids : tuple):
+		from .pong import PongGame
+		from .pong_components import Player
+
+		class ShardGame(PongGame):
+			async def setup_players(self):
+				self.player1 = Player(player_ids[0], self.paddleLeft)
+				self.player2 = Player(player_ids[1], self.paddleRight)
+
+		game = ShardGame('vs', seed)
+		game.enable_rewind()
+		game.add_consumer(ShardRelay(self, game_id))
+		await game.init_game_components()
+		self.games[game_id] = game
+		await game.start()
+
+	async def handle(self, message : tuple):
+		action, game_id, *args = message
+		game = self.games.get(game_id)
+		match action:
+			case 'create':
+				await self.create(game_id, *args)
+			case 'input' if game:
+				game.queue_input(*args)
+			case 'ack_reset' if game:
+				side, epoch = args
+				game.reset_ack(side)
+				game.consumers[0].ack_epochs[side] = epoch
+			case 'pause' if game:
+				game.detach()
+			case 'resume' if game:
+				game.attach()
+			case 'remove' if game:
+				game.running = False
+				game.detach()
+				del self.games[game_id]
+			case 'stop':
+				self.stopped.set()
+
+	def on_readable(self):
+		try:
+			while self.conn.poll():
+				asyncio.ensure_future(self.handle(self.conn.recv()))
+		except (EOFError, OSError):
+			# parent is gone, nothing left to serve
+			self.stopped.set()
+
+	async def report_load(self, interval : float):
+		from .engine import tick_engine
+		while not self.stopped.is_set():
+			self.send(('load', None, {
+				'pid': os.getpid(),
+				'games': len(self.games),
+				'engine': tick_engine.stats(),
+				'time': time.time(),
+			}))
+			await asyncio.sleep(interval)
+
+	async def run(self, interval : float):
+		self.stopped = asyncio.Event()
+		asyncio.get_running_loop().add_reader(self.conn.fileno(), self.on_readable)
+		reporter = asyncio.create_task(self.report_load(interval))
+		await self.stopped.wait()
+		reporter.cancel()
+
+
+def main(conn, shard_id : int, interval : float):
+	import django
+	django.setup()
+	logger.info(f"Pong shard {shard_id} started in process {os.getpid()}")
+	asyncio.run(ShardWorker(conn, shard_id).run(interval))
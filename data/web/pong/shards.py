@@ -0,0 +1,206 @@
+from .pong_components import GAME_SETTINGS
+from .pong import MultiPongGame
+from .replay import ReplayRecorder
+from . import shard_worker
+import asyncio, multiprocessing, logging
+
+logger = logging.getLogger('pong')
+
+
+class Shard:
+	def __init__(self, shard_id : int, process, conn):
+		self.shard_id = shard_id
+		self.process = process
+		self.conn = conn
+		self.games = set()
+		self.load = {}
+		self.alive = True
+
+	def stats(self) -> dict:
+		return {
+			'shard': self.shard_id,
+			'alive': self.alive,
+			'games': len(self.games),
+			'load': self.load,
+		}
+
+
+class ShardPool:
+	"""
+	Runs multiplayer matches on 'size' worker processes (see shard_worker.py),
+	each with its own tick engine. The web process keeps a ShardedGame per match
+	and only relays inputs to the worker and frames back to the consumers over a
+	pipe. New matches go to the shard with the fewest games, ties broken by the
+	last overrun its tick loop reported. Workers are spawned on first use.
+	"""
+	def __init__(self, size : int, load_interval : float):
+		self.size = size
+		self.load_interval = load_interval
+		self.shards = []
+		self.games = {} # game_id -> ShardedGame
+		self.queue : asyncio.Queue = None
+		self.dispatcher : asyncio.Task = None
+		self.placed = 0
+
+	@property
+	def enabled(self) -> bool:
+		return self.size > 0
+
+	def start(self):
+		ctx = multiprocessing.get_context('spawn')
+		loop = asyncio.get_running_loop()
+		self.queue = asyncio.Queue()
+		for shard_id in range(self.size):
+			conn, child_conn = ctx.Pipe()
+			process = ctx.Process(target=shard_worker.main, args=(child_conn, shard_id, self.load_interval), daemon=True)
+			process.start()
+			child_conn.close()
+			shard = Shard(shard_id, process, conn)
+			loop.add_reader(conn.fileno(), self.on_readable, shard)
+			self.shards.append(shard)
+		self.dispatcher = asyncio.create_task(self.dispatch())
+		logger.info(f"Started {self.size} pong shards")
+
+	def on_readable(self, shard : Shard):
+		try:
+			while shard.conn.poll():
+				self.queue.put_nowait((shard, shard.conn.recv()))
+		except (EOFError, OSError):
+			asyncio.get_running_loop().remove_reader(shard.conn.fileno())
+			self.queue.put_nowait((shard, None))
+
+	async def dispatch(self):
+		"""Handles worker messages one at a time, so frames of a game are relayed in order."""
+		while True:
+			shard, message = await self.queue.get()
+			try:
+				if message is None:
+					await self.shard_died(shard)
+					continue
+				action, game_id, *args = message
+				if action == 'load':
+					shard.load = args[0]
+					continue
+				game = self.games.get(game_id)
+				if game is None:
+					continue
+				match action:
+					case 'state':
+						await game.on_state(*args)
+					case 'score':
+						await game.on_score(*args)
+					case 'end':
+						await game.on_end(*args)
+			except Exception as e:
+				logger.error(f"Error handling shard {shard.shard_id} message: {e}")
+
+	async def shard_died(self, shard : Shard):
+		shard.alive = False
+		logger.error(f"Pong shard {shard.shard_id} exited, ending its {len(shard.games)} games")
+		for game_id in list(shard.games):
+			if game := self.games.get(game_id):
+				await game.end_game()
+
+	def place(self, game : 'ShardedGame'):
+		if not self.shards:
+			self.start()
+		alive = [shard for shard in self.shards if shard.alive]
+		if not alive:
+			raise RuntimeError("No pong shard left alive")
+		shard = min(alive, key=lambda s: (len(s.games), s.load.get('engine', {}).get('last_overrun', 0)))
+		shard.games.add(game.game_id)
+		self.games[game.game_id] = game
+		game.shard = shard
+		self.placed += 1
+		self.send(game, ('create', game.game_id, game.seed, (game.player1.player_id, game.player2.player_id)))
+
+	def release(self, game : 'ShardedGame'):
+		if self.games.pop(game.game_id, None) is None:
+			return
+		game.shard.games.discard(game.game_id)
+		self.send(game, ('remove', game.game_id))
+		game.shard = None
+
+	def send(self, game : 'ShardedGame', message : tuple):
+		shard = game.shard
+		if shard is None or not shard.alive:
+			return
+		try:
+			shard.conn.send(message)
+		except (BrokenPipeError, OSError) as e:
+			logger.error(f"Error sending to pong shard {shard.shard_id}: {e}")
+
+	def stats(self) -> dict:
+		return {
+			'size': self.size,
+			'games': len(self.games),
+			'placed': self.placed,
+			'shards': [shard.stats() for shard in self.shards],
+		}
+
+
+class ShardedGame(MultiPongGame):
+	"""
+	A MultiPongGame simulated on a shard. Components here are a mirror of the
+	worker's, refreshed by every frame it relays, so broadcasting, scores, the
+	replay and completion work as for a local game. Not checkpointed.
+	"""
+	def __init__(self, game_id, seed : int = None):
+		super().__init__(game_id, seed)
+		self.shard : Shard = None
+		self.history = None # late inputs are rewound on the worker
+		self.ack_epochs = {'left': 0, 'right': 0} # acks from before the last reset_ack() are still in flight
+
+	def attach(self):
+		shard_pool.send(self, ('resume', self.game_id))
+
+	def detach(self):
+		shard_pool.send(self, ('pause', self.game_id))
+
+	def set_direction(self, side : str, direction : int):
+		self.queue_input(side, direction)
+
+	def queue_input(self, side : str, direction : int, seq : int = None, tick : int = None):
+		# recorded on the worker at the tick it is applied, it comes back with the next frame
+		shard_pool.send(self, ('input', self.game_id, side, direction, seq, tick))
+
+	def reset_ack(self, side : str):
+		super().reset_ack(side)
+		self.ack_epochs[side] += 1
+		shard_pool.send(self, ('ack_reset', self.game_id, side, self.ack_epochs[side]))
+
+	async def start(self):
+		self.running = True
+		await self.broadcast_game_start()
+		shard_pool.place(self)
+
+	async def on_state(self, tick : int, ball_x : float, ball_y : float, l_paddle_y : float, r_paddle_y : float,
+			from_tick : int, inputs : list, acks : dict, epochs : dict):
+		self.tick_count = self.replay.ticks = tick
+		while self.replay.inputs and self.replay.inputs[-1][0] >= from_tick:
+			self.replay.inputs.pop()
+		self.replay.inputs.extend(inputs)
+		for side, ack in acks.items():
+			if epochs[side] == self.ack_epochs[side]:
+				self.input_acks[side] = ack
+		self.ball.x, self.ball.y = ball_x, ball_y
+		self.paddleLeft.y, self.paddleRight.y = l_paddle_y, r_paddle_y
+		await self.broadcast_game_state()
+
+	async def on_score(self, state : dict):
+		self.player1.score, self.player2.score = state['player1_score'], state['player2_score']
+		self.player1.sets, self.player2.sets = state['player1_sets'], state['player2_sets']
+		await self.scoreBoard.send()
+
+	async def on_end(self, side : str, replay : bytes):
+		self.replay = ReplayRecorder.decode(replay)
+		self.tick_count = self.replay.ticks
+		shard_pool.release(self)
+		await self.finish(self.player1 if side == 'left' else self.player2)
+
+	async def end_game(self):
+		shard_pool.release(self)
+		await super().end_game()
+
+
+shard_pool = ShardPool(GAME_SETTINGS['engine']['shards'], GAME_SETTINGS['engine']['shard_load_interval'])
@@ -0,0 +1,77 @@
+from .pong_components import GAME_SETTINGS
+import json, logging
+
+logger = logging.getLogger('pong')
+
+# spectators admitted or turned away at the per-game limit, and frames fanned
+# out to them (one per viewer per broadcast), across every game of this process
+spectator_stats = {
+	'joined': 0,
+	'rejected': 0,
+	'frames': 0,
+}
+
+
+class SpectatorGroup:
+	"""
+	Read-only viewers of one live game. The group is fed the game's shared
+	GameSnapshot every 'interval' broadcasts and every other event encoded once,
+	so the tick cost does not grow with the number of viewers beyond queueing
+	the already encoded frame on each socket's outbox.
+	"""
+	def __init__(self, game, limit : int = None):
+		self.game = game
+		self.limit = limit or GAME_SETTINGS['spectate']['max_per_game']
+		self.interval = max(1, GAME_SETTINGS['engine']['send_rate'] // GAME_SETTINGS['spectate']['send_rate'])
+		self.viewers = set()
+		self.broadcasts = 0
+		self.frames = 0
+		self.peak = 0
+		self.rejected = 0
+
+	def __len__(self):
+		return len(self.viewers)
+
+	def add(self, consumer) -> bool:
+		if len(self.viewers) >= self.limit:
+			self.rejected += 1
+			spectator_stats['rejected'] += 1
+			return False
+		self.viewers.add(consumer)
+		self.peak = max(self.peak, len(self.viewers))
+		spectator_stats['joined'] += 1
+		return True
+
+	def remove(self, consumer):
+		self.viewers.discard(consumer)
+
+	def broadcast(self, message : dict):
+		if not self.viewers:
+			return
+		text_data = json.dumps(message)
+		for viewer in self.viewers:
+			viewer.enqueue(text_data)
+
+	def broadcast_game_state(self, snapshot):
+		if not self.viewers:
+			return
+		self.broadcasts += 1
+		if self.broadcasts % self.interval:
+			return
+		for viewer in self.viewers:
+			viewer.broadcast_snapshot(snapshot)
+		self.frames += len(self.viewers)
+		spectator_stats['frames'] += len(self.viewers)
+
+	async def shutdown(self):
+		for viewer in list(self.viewers):
+			await viewer.shutdown()
+		self.viewers.clear()
+
+	def stats(self) -> dict:
+		return {
+			'viewers': len(self.viewers),
+			'peak': self.peak,
+			'rejected': self.rejected,
+			'frames': self.frames,
+		}
@@ -0,0 +1,138 @@
+from .pong_components import GAME_SETTINGS
+import asyncio, math, time, logging
+
+logger = logging.getLogger('pong')
+
+
+class TimerHandle:
+	__slots__ = ('wheel', 'expires', 'callback', 'args', 'slot', 'cancelled')
+
+	def __init__(self, wheel, expires : int, callback, args : tuple):
+		self.wheel = wheel
+		self.expires = expires
+		self.callback = callback
+		self.args = args
+		self.slot : set = None
+		self.cancelled = False
+
+	def cancel(self):
+		if self.cancelled:
+			return
+		self.cancelled = True
+		if self.slot is not None:
+			self.slot.discard(self)
+			self.slot = None
+			self.wheel.pending -= 1
+			self.wheel.cancelled += 1
+
+
+class TimerWheel:
+	"""
+	Hierarchical timing wheel: 'levels' wheels of 'slots' buckets each, level n
+	bucket width being slots**n * resolution. Scheduling and cancelling are O(1)
+	(a set insert/discard), timers far in the future sit in a coarse bucket and
+	cascade down a level each time the wheel below wraps around.
+
+	Callbacks may be plain functions or coroutine functions (run as a task).
+	Driven by its own event loop task while timers are pending, or by calling
+	advance() from an existing loop. Not thread-safe: one wheel per event loop.
+	"""
+	def __init__(self, resolution : float, slots : int = 64, levels : int = 4):
+		if slots & (slots - 1):
+			raise ValueError("slots must be a power of two")
+		self.resolution = resolution
+		self.slots = slots
+		self.levels = levels
+		self.bits = slots.bit_length() - 1
+		self.mask = slots - 1
+		self.wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+		self.origin = time.monotonic()
+		self.current = 0
+		self.pending = 0
+		self.fired = 0
+		self.cancelled = 0
+		self.task : asyncio.Task = None
+
+	def now(self) -> int:
+		return int((time.monotonic() - self.origin) / self.resolution)
+
+	def call_later(self, delay : float, callback, *args) -> TimerHandle:
+		if not self.pending:
+			# nothing is bucketed, the idle wheel can jump straight to the present
+			self.current = max(self.current, self.now())
+		expires = max(self.current + 1, self.now() + math.ceil(delay / self.resolution))
+		handle = TimerHandle(self, expires, callback, args)
+		self._insert(handle)
+		self.pending += 1
+		if not self.task or self.task.done():
+			self.task = asyncio.create_task(self.run())
+		return handle
+
+	def _insert(self, handle : TimerHandle):
+		target = max(handle.expires, self.current)
+		if target - self.current >= self.slots ** self.levels:
+			# beyond the top wheel, park it in the furthest bucket, it is re-inserted when that cascades
+			target = self.current + self.slots ** self.levels - 1
+		level = 0
+		while target - self.current >= self.slots ** (level + 1):
+			level += 1
+		slot = self.wheels[level][(target >> (self.bits * level)) & self.mask]
+		slot.add(handle)
+		handle.slot = slot
+
+	def _cascade(self, level : int):
+		slot = self.wheels[level][(self.current >> (self.bits * level)) & self.mask]
+		handles = list(slot)
+		slot.clear()
+		for handle in handles:
+			self._insert(handle)
+
+	def _fire(self, handle : TimerHandle):
+		handle.slot = None
+		self.pending -= 1
+		self.fired += 1
+		try:
+			result = handle.callback(*handle.args)
+			if asyncio.iscoroutine(result):
+				asyncio.create_task(result)
+		except Exception as e:
+			logger.error(f"Error in timer callback {getattr(handle.callback, '__name__', handle.callback)}: {e}")
+
+	def advance(self, target : int = None):
+		"""Moves the wheel forward to 'target' (default: now), firing everything that expired on the way."""
+		target = self.now() if target is None else target
+		while self.current < target and self.pending:
+			self.current += 1
+			top = 0
+			while top + 1 < self.levels and not self.current & ((1 << (self.bits * (top + 1))) - 1):
+				top += 1
+			for level in range(top, 0, -1):
+				self._cascade(level)
+
+			slot = self.wheels[0][self.current & self.mask]
+			if slot:
+				handles = list(slot)
+				slot.clear()
+				for handle in handles:
+					self._fire(handle)
+		self.current = max(self.current, target)
+
+	def stats(self) -> dict:
+		return {
+			'pending': self.pending,
+			'fired': self.fired,
+			'cancelled': self.cancelled,
+			'resolution': self.resolution,
+		}
+
+	async def run(self):
+		while self.pending:
+			await asyncio.sleep(self.resolution)
+			self.advance()
+
+
+timer_wheel = TimerWheel(
+	GAME_SETTINGS['timers']['resolution'],
+	GAME_SETTINGS['timers']['slots'],
+	GAME_SETTINGS['timers']['levels'],
+)
@@ -0,0 +1,7 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+	path('pong/metrics/', views.engine_metrics, name='pong-metrics'),
+	path('pong/drain/', views.engine_drain, name='pong-drain'),
+]
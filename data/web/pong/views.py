@@ -0,0 +1,124 @@
+from django.http import HttpResponse, JsonResponse
+
+from .engine import tick_engine
+from .pong import PongGame
+from .consumers import SinglePongConsumer, MultiPongConsumer
+from .lobby import QuickLobby
+from .protocol import serialization_stats
+from .outbox import outbox_stats
+from .spectators import spectator_stats
+from .timers import timer_wheel
+from .scores import score_buffer
+from .checkpoints import checkpointer
+from .drain import drain
+from .shards import shard_pool
+from .registry import registry
+from . import metrics
+
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework.permissions import IsAdminUser
+from asgiref.sync import async_to_sync
+
+import logging
+
+logger = logging.getLogger('pong')
+
+
+async def collect_engine_metrics() -> dict:
+	"""Runs on the event loop, the engine, checkpointer and shard pool mutate these containers there."""
+	# replay playbacks tick on the engine too but are not games, sharded games tick on a worker
+	engine_games = [game for game in tick_engine.games if isinstance(game, PongGame)]
+	games = list(dict.fromkeys(engine_games + list(shard_pool.games.values())))
+	return {
+		'engine': tick_engine.stats(),
+		'timers': timer_wheel.stats(),
+		'scores': score_buffer.stats(),
+		'checkpoints': checkpointer.stats(),
+		'drain': drain.status(),
+		'shards': shard_pool.stats(),
+		'registry': registry.stats(),
+		'counts': {
+			'live_games': len(games),
+			'replays': len(tick_engine.games) - len(engine_games),
+			'sharded_games': len(shard_pool.games),
+			'single_games': len(SinglePongConsumer.active_games),
+			'multi_games': len(MultiPongConsumer.active_games),
+			'consumers': sum(len(game.consumers) for game in games),
+			'spectators': sum(len(game.spectators) for game in games),
+			'lobby_players': len(QuickLobby.queued_players),
+		},
+		'serialization': dict(serialization_stats),
+		'outbox': dict(outbox_stats),
+		'spectate': dict(spectator_stats),
+		'games': [{
+			'game_id': getattr(game, 'game_id', str(id(game))),
+			'mode': game.mode,
+			'shard': game.shard.shard_id if getattr(game, 'shard', None) else None,
+			'tick_count': game.tick_count,
+			'consumers': len(game.consumers),
+			'frames_sent': game.frames_sent,
+			'frames_dropped': game.frames_dropped,
+			'serializations': game.serializations,
+			'rewinds': game.rewinds,
+			'rewound_ticks': game.rewound_ticks,
+			'rewinds_refused': game.rewinds_refused,
+			'spectators': game.spectators.stats(),
+			'links': [c.link.stats() for c in game.consumers if getattr(c, 'link', None)],
+			**game.metrics.summary(),
+		} for game in games],
+	}
+
+
+def prometheus_text(data : dict) -> str:
+	lines = []
+	for name, value in data['counts'].items():
+		lines += [f'# TYPE pong_{name} gauge', f'pong_{name} {value}']
+	for name in ('tick_count', 'overruns', 'skipped_steps'):
+		lines += [f'# TYPE pong_engine_{name} counter', f'pong_engine_{name} {data["engine"][name]}']
+	lines += ['# TYPE pong_timers_pending gauge', f'pong_timers_pending {data["timers"]["pending"]}']
+	for name in ('fired', 'cancelled'):
+		lines += [f'# TYPE pong_timers_{name}_total counter', f'pong_timers_{name}_total {data["timers"][name]}']
+	lines += ['# TYPE pong_scores_dirty gauge', f'pong_scores_dirty {data["scores"]["dirty"]}']
+	for name in ('records', 'flushes', 'rows'):
+		lines += [f'# TYPE pong_scores_{name}_total counter', f'pong_scores_{name}_total {data["scores"][name]}']
+	lines += ['# TYPE pong_checkpoints_tracked gauge', f'pong_checkpoints_tracked {data["checkpoints"]["tracked"]}']
+	lines += ['# TYPE pong_checkpoints_written_total counter', f'pong_checkpoints_written_total {data["checkpoints"]["written"]}']
+	lines += ['# TYPE pong_draining gauge', f'pong_draining {int(data["drain"]["draining"])}']
+	lines += ['# TYPE pong_engine_last_overrun_seconds gauge', f'pong_engine_last_overrun_seconds {data["engine"]["last_overrun"]}']
+	for name, value in data['serialization'].items():
+		lines += [f'# TYPE pong_serialized_{name}_total counter', f'pong_serialized_{name}_total {value}']
+	for name, value in data['outbox'].items():
+		lines += [f'# TYPE pong_outbox_{name}_total counter', f'pong_outbox_{name}_total {value}']
+	for name, value in data['spectate'].items():
+		lines += [f'# TYPE pong_spectators_{name}_total counter', f'pong_spectators_{name}_total {value}']
+	lines += ['# TYPE pong_frames_dropped gauge', f'pong_frames_dropped {sum(g["frames_dropped"] for g in data["games"])}']
+	lines += metrics.tick_duration.prometheus('pong_tick_duration_seconds')
+	lines += metrics.tick_jitter.prometheus('pong_tick_jitter_seconds')
+	lines += metrics.send_duration.prometheus('pong_send_duration_seconds')
+	return '\n'.join(lines) + '\n'
+
+
+@api_view(["GET"])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAdminUser])
+def engine_metrics(request):
+	data = async_to_sync(collect_engine_metrics)()
+	if request.GET.get('format') == 'json':
+		return JsonResponse(data)
+	return HttpResponse(prometheus_text(data), content_type='text/plain; version=0.0.4')
+
+
+@api_view(["GET", "POST"])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAdminUser])
+def engine_drain(request):
+	"""GET reports the drain state, POST starts draining (optional 'timeout' in seconds)."""
+	if request.method == 'POST':
+		try:
+			timeout = float(request.data['timeout']) if request.data.get('timeout') else None
+		except (TypeError, ValueError):
+			return JsonResponse({'error': 'timeout must be a number of seconds'}, status=400)
+		async_to_sync(drain.start)(timeout)
+		logger.info(f"Drain requested by {request.user.username}")
+	return JsonResponse(drain.status())
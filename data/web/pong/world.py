@@ -0,0 +1,232 @@
+from .pong_components import Paddle, Ball, Player, ScoreBoard, GAME_SETTINGS, STEP_SCALE
+import numpy as np
+import random, secrets, time
+
+
+class SlotGame:
+	"""The scalar components of one world slot, stepped by Ball.update when its ball makes contact."""
+	def __init__(self, seed : int, player_ids : tuple):
+		self.seed = seed
+		self.rng = random.Random(seed)
+		self.paddleLeft = Paddle(GAME_SETTINGS['l_paddle']['start_x'], GAME_SETTINGS['l_paddle']['start_y'])
+		self.paddleRight = Paddle(GAME_SETTINGS['r_paddle']['start_x'], GAME_SETTINGS['r_paddle']['start_y'])
+		self.ball = Ball(self.rng)
+		self.player1 = Player(player_ids[0], self.paddleLeft)
+		self.player2 = Player(player_ids[1], self.paddleRight)
+		self.scoreBoard = ScoreBoard(self, self.player1, self.player2)
+		self.ball.reset(self.scoreBoard, self.player1, self.player2)
+
+
+class GameWorld:
+	"""
+	Struct-of-arrays physics for many 'vs' matches: ball, paddle and score state
+	of every match live in flat NumPy arrays, one slot per match, and step()
+	advances all of them at once.
+
+	Free flight (the ball touches nothing and stays on the field) is most steps
+	and is vectorized with the same float operations as Paddle.update and
+	Ball.update. A slot whose ball reaches a wall or paddle, or leaves the field,
+	is stepped by the real Ball.update on its SlotGame, which draws from that
+	match's own rng. A slot therefore plays out bit-for-bit like a PongGame with
+	the same seed and inputs, see HeadlessPongGame.
+	"""
+	def __init__(self, capacity : int = 1024):
+		self.capacity = capacity
+		self.width = GAME_SETTINGS['field']['width']
+		self.height = GAME_SETTINGS['field']['height']
+		self.size = GAME_SETTINGS['ball']['size']
+		self.paddle_w = GAME_SETTINGS['paddle']['width']
+		self.paddle_h = GAME_SETTINGS['paddle']['height']
+		self.paddle_velo = GAME_SETTINGS['paddle']['velo']
+		self.l_x = GAME_SETTINGS['l_paddle']['start_x']
+		self.r_x = GAME_SETTINGS['r_paddle']['start_x']
+
+		self.games : list = [None] * capacity
+		self.active = np.zeros(capacity, dtype=bool)
+		self.tick_count = np.zeros(capacity, dtype=np.int64)
+		self.ball_x = np.zeros(capacity)
+		self.ball_y = np.zeros(capacity)
+		self.ball_dx = np.zeros(capacity)
+		self.ball_dy = np.zeros(capacity)
+		self.ball_v = np.zeros(capacity)
+		self.carry = np.zeros(capacity)
+		self.wait = np.zeros(capacity, dtype=np.int64)
+		self.l_y = np.zeros(capacity)
+		self.r_y = np.zeros(capacity)
+		self.l_dir = np.zeros(capacity)
+		self.r_dir = np.zeros(capacity)
+		self.l_score = np.zeros(capacity, dtype=np.int64)
+		self.r_score = np.zeros(capacity, dtype=np.int64)
+		self.l_sets = np.zeros(capacity, dtype=np.int64)
+		self.r_sets = np.zeros(capacity, dtype=np.int64)
+		self.free = list(range(capacity - 1, -1, -1))
+		self.slow_steps = 0 # slot steps handed to Ball.update
+
+	def __len__(self):
+		return self.capacity - len(self.free)
+
+	def add_game(self, seed : int = None, player_ids : tuple = ('player1', 'player2')) -> int:
+		if not self.free:
+			raise ValueError("Game world is full")
+		slot = self.free.pop()
+		self.games[slot] = SlotGame(seed if seed is not None else secrets.randbits(32), player_ids)
+		self.active[slot] = True
+		self.tick_count[slot] = 0
+		self.l_dir[slot] = self.r_dir[slot] = 0
+		self.load(slot)
+		return slot
+
+	def remove_game(self, slot : int):
+		if self.active[slot]:
+			self.active[slot] = False
+			self.games[slot] = None
+			self.free.append(slot)
+
+	def set_direction(self, slot : int, side : str, direction : int):
+		(self.l_dir if side == 'left' else self.r_dir)[slot] = direction
+
+	def load(self, slot : int):
+		"""Copies a SlotGame into the arrays."""
+		game = self.games[slot]
+		ball = game.ball
+		self.ball_x[slot], self.ball_y[slot] = ball.x, ball.y
+		self.ball_dx[slot], self.ball_dy[slot] = ball.dx, ball.dy
+		self.ball_v[slot], self.carry[slot], self.wait[slot] = ball.velo, ball.carry, ball.wait_ticks
+		self.l_y[slot], self.r_y[slot] = game.paddleLeft.y, game.paddleRight.y
+		self.l_score[slot], self.r_score[slot] = game.player1.score, game.player2.score
+		self.l_sets[slot], self.r_sets[slot] = game.player1.sets, game.player2.sets
+
+	def store(self, slot : int) -> 'SlotGame':
+		"""Copies the arrays into a SlotGame, scores and sets only ever change on it."""
+		game = self.games[slot]
+		ball = game.ball
+		ball.x, ball.y = float(self.ball_x[slot]), float(self.ball_y[slot])
+		ball.dx, ball.dy = float(self.ball_dx[slot]), float(self.ball_dy[slot])
+		ball.velo, ball.carry, ball.wait_ticks = float(self.ball_v[slot]), float(self.carry[slot]), int(self.wait[slot])
+		game.paddleLeft.y, game.paddleRight.y = float(self.l_y[slot]), float(self.r_y[slot])
+		return game
+
+	def get_state(self, slot : int) -> dict:
+		return {
+			'l_paddle_y': float(self.l_y[slot]),
+			'r_paddle_y': float(self.r_y[slot]),
+			'ball_x': float(self.ball_x[slot]),
+			'ball_y': float(self.ball_y[slot]),
+		}
+
+	def get_score(self, slot : int) -> dict:
+		return {
+			'player1_score': int(self.l_score[slot]),
+			'player2_score': int(self.r_score[slot]),
+			'player1_sets': int(self.l_sets[slot]),
+			'player2_sets': int(self.r_sets[slot]),
+		}
+
+	def track_ball(self, side : str, dead_zone : int = 20):
+		"""headless.track_ball for every slot at once."""
+		paddle_y, directions = (self.l_y, self.l_dir) if side == 'left' else (self.r_y, self.r_dir)
+		diff = (self.ball_y + self.size / 2) - (paddle_y + self.paddle_h / 2)
+		directions[:] = np.where(np.abs(diff) < dead_zone, 0, np.sign(diff))
+
+	def contacts(self, moving : np.ndarray, remaining : np.ndarray):
+		"""
+		Ball._wall_impact and Ball._paddle_impact for the first stretch of the step.
+		Returns which moving slots touch something within 'remaining', and the
+		vx, vy they fly with.
+		"""
+		x, y, size = self.ball_x, self.ball_y, self.size
+		vx = self.ball_v * self.ball_dx * STEP_SCALE
+		vy = self.ball_v * self.ball_dy * STEP_SCALE
+		with np.errstate(divide='ignore', invalid='ignore'):
+			t_wall = np.where(vy < 0, (size - y) / vy, (self.height - size - y) / vy)
+			wall = (vy != 0) & (t_wall <= remaining)
+
+			left = vx < 0
+			paddle_y = np.where(left, self.l_y, self.r_y)
+			t_paddle = np.maximum(0.0, np.where(left,
+				(self.l_x + self.paddle_w - x) / vx,
+				(self.r_x - x - size) / vx))
+			in_front = np.where(left, x + size >= self.l_x, x <= self.r_x + self.paddle_w)
+			at_y = y + vy * t_paddle
+			paddle = ((vx != 0) & in_front & (t_paddle <= remaining)
+				& (at_y + size >= paddle_y) & (at_y <= paddle_y + self.paddle_h))
+		return moving & (wall | paddle), vx, vy
+
+	def step(self) -> list:
+		"""
+		Advances every active game by one engine step, PongGame.simulate_step for
+		a whole world. Returns the ScoreBoard events of the step as (slot, event, side),
+		'side' being the player the event is about. A slot keeps playing after its
+		match_end until the caller removes it.
+		"""
+		active = self.active
+		self.tick_count[active] += 1
+
+		l_y = self.l_y + self.l_dir * self.paddle_velo * STEP_SCALE
+		r_y = self.r_y + self.r_dir * self.paddle_velo * STEP_SCALE
+		limit = self.height - self.paddle_h
+		self.l_y = np.where(active, np.clip(l_y, 0, limit), self.l_y)
+		self.r_y = np.where(active, np.clip(r_y, 0, limit), self.r_y)
+
+		waiting = active & (self.wait > 0)
+		self.wait[waiting] -= 1
+		moving = active & ~waiting
+
+		remaining = 1.0 + self.carry
+		contact, vx, vy = self.contacts(moving, remaining)
+		free = moving & ~contact
+		x = self.ball_x + vx * remaining
+		scored = free & ((x <= 0) | (x >= self.width))
+		free &= ~scored
+		self.ball_x = np.where(free, x, self.ball_x)
+		self.ball_y = np.where(free, self.ball_y + vy * remaining, self.ball_y)
+		self.carry[free] = 0.0
+
+		events = []
+		for slot in np.flatnonzero(contact | scored).tolist():
+			game = self.store(slot)
+			game.ball.update(game.scoreBoard, game.player1, game.player2)
+			self.load(slot)
+			for event, player in game.scoreBoard.drain():
+				events.append((slot, event, 'left' if player is game.player1 else 'right'))
+			self.slow_steps += 1
+		return events
+
+
+def simulate_batch(seeds : list, max_ticks : int = None) -> list:
+	"""
+	headless.simulate() with every match in one GameWorld: the default track_ball
+	controllers on both sides, one match per seed. Returns the same stats as
+	HeadlessPongGame.run() minus the per-tick timings.
+	"""
+	max_ticks = max_ticks or 60 * 60 * GAME_SETTINGS['engine']['tick_rate']
+	world = GameWorld(len(seeds))
+	slots = [world.add_game(seed) for seed in seeds]
+	winners = {}
+	start = time.perf_counter_ns()
+	for _ in range(max_ticks):
+		if not len(world):
+			break
+		world.track_ball('left')
+		world.track_ball('right', dead_zone=45)
+		for slot, event, side in world.step():
+			if event == 'match_end':
+				game = world.games[slot]
+				winners[slot] = (game.player1 if side == 'left' else game.player2).player_id, world.get_score(slot), int(world.tick_count[slot])
+				world.remove_game(slot)
+	total = time.perf_counter_ns() - start
+
+	results = []
+	for slot in slots:
+		if slot in winners:
+			winner, score, ticks = winners[slot]
+		else:
+			winner, score, ticks = None, world.get_score(slot), int(world.tick_count[slot])
+		results.append({
+			'winner': winner,
+			'ticks': ticks,
+			'game_seconds': ticks / GAME_SETTINGS['engine']['tick_rate'],
+			**score,
+			'elapsed_ns': total,
+		})
+	return results
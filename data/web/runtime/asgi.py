@@ -17,16 +17,17 @@ from channels.sessions import SessionMiddlewareStack
 from channels.auth import AuthMiddlewareStack # authetication verification for socket connections
 from pong.routing import pong_websocket_urlpatterns
 from backend.routing import backend_websocket_urlpatterns
+from pong.drain import drain_on_signal
 
 websocket_urlpatterns = pong_websocket_urlpatterns + backend_websocket_urlpatterns
 
-application = ProtocolTypeRouter({
+application = drain_on_signal(ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": SessionMiddlewareStack(
         AuthMiddlewareStack(
             URLRouter(websocket_urlpatterns)
         )
     ),
-})
+}))
 
 
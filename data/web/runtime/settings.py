@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
+import os
 from authservice.config import SOCIALACCOUNT_PROVIDERS as FORTY_TWO_PROVIDERS
 from datetime import timedelta
 
@@ -203,11 +204,24 @@ WSGI_APPLICATION = 'runtime.wsgi.application'
 
 ASGI_APPLICATION = 'runtime.asgi.application'
 
-CHANNEL_LAYERS = {
-	"default": {
-		"BACKEND": "channels.layers.InMemoryChannelLayer"
+# set to share channel groups and the pong registry (pong/registry.py) between several ASGI workers
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+	CHANNEL_LAYERS = {
+		"default": {
+			"BACKEND": "channels_redis.core.RedisChannelLayer",
+			"CONFIG": {
+				"hosts": [REDIS_URL],
+			}
+		}
+	}
+else:
+	CHANNEL_LAYERS = {
+		"default": {
+			"BACKEND": "channels.layers.InMemoryChannelLayer"
+		}
 	}
-}
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -54,6 +54,7 @@ urlpatterns = [
 	path('', include('authservice.urls')),
 	path('', include('tournaments.urls')),
 	path('', include('dashboard.urls')),
+	path('', include('pong.urls')),
     
 	# match any end-point not previously matched
 	re_path(r'^.*$', redirect_to_not_found, name='not-found'),
@@ -6,7 +6,7 @@ import { NavMenu } from '../nav/NavMenu.js';
 import { LoginMenu } from '../login/LoginMenu.js';
 
 import { HomeView } from '../home/HomeView.js';
-import { PongView } from '../pong/PongView.js';
+import { PongView, WatchView, ReplayView } from '../pong/PongView.js';
 import { TournamentView } from '../pong/TournamentView.js';
 import { ProfileView } from '../profile/ProfileView.js';
 import { RegisterView } from '../login/RegisterView.js';
@@ -24,6 +24,8 @@ Router.subscribe('home', HomeView);
 Router.subscribe('not-found', NotFoundView);
 Router.subscribe('profile', ProfileView);
 Router.subscribe('pong', PongView);
+Router.subscribe('watch', WatchView);
+Router.subscribe('replay', ReplayView);
 Router.subscribe('tournament', TournamentView);
 Router.subscribe('register', RegisterView);
 Router.subscribe('login', LoginView);
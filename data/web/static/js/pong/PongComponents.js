@@ -9,10 +9,57 @@ export class Player {
 		this.side = side; // redundant for mp
 		this.keydownListener = null;
 		this.keyupListener = null;
+
+		// client-side prediction, see reconcile() and predict()
+		this.predicting = false;
+		this.seq = 0;
+		this.pending = [];
+		this.base = null;
+		this.ackedDirection = 0;
+		this.viewTick = () => undefined; // server tick on screen, lets the server rewind late inputs
+	}
+
+	sendInput(action, direction) {
+		this.seq += 1;
+		const value = action === "paddle_move_stop" ? 0 : direction === "up" ? -1 : 1;
+		this.pending.push({ seq: this.seq, direction: value, time: performance.now() });
+		this.socket.send(JSON.stringify({
+			action: action,
+			direction: direction,
+			side: this.side,
+			seq: this.seq,
+			tick: this.viewTick()
+		}));
+	}
+
+	// server state of our paddle at a snapshot: drop the inputs it already applied
+	reconcile(y, ack) {
+		while (this.pending.length && this.pending[0].seq <= ack) {
+			this.ackedDirection = this.pending.shift().direction;
+		}
+		this.base = { y: y, time: performance.now(), direction: this.ackedDirection };
+	}
+
+	// replays the inputs the server has not applied yet on top of its last state
+	predict(speed, maxY) {
+		if (!this.base) return null;
+		const now = performance.now();
+		const clamp = (y) => Math.max(0, Math.min(maxY, y));
+		let y = this.base.y;
+		let time = this.base.time;
+		let direction = this.base.direction;
+		for (const input of this.pending) {
+			const start = Math.min(now, Math.max(time, input.time));
+			y = clamp(y + direction * speed * (start - time) / 1000);
+			time = start;
+			direction = input.direction;
+		}
+		return clamp(y + direction * speed * (now - time) / 1000);
 	}
 
 	inputManager(upKey, downKey) {
 		let lastPressed = null;
+		this.predicting = true;
 		const keys = {
 			[upKey]: false,
 			[downKey]: false
@@ -22,11 +69,7 @@ export class Player {
 			if (e.key in keys && !keys[e.key]) {
 				keys[e.key] = true;
 				lastPressed = e.key;
-				this.socket.send(JSON.stringify({
-					action: "paddle_move_start",
-					direction: e.key === upKey ? "up" : "down",
-					side: this.side
-				}));
+				this.sendInput("paddle_move_start", e.key === upKey ? "up" : "down");
 			}
 		};
 
@@ -36,11 +79,10 @@ export class Player {
 				if (e.key === lastPressed) {
 					lastPressed = keys[upKey] ? upKey : keys[downKey] ? downKey : null;
 				}
-				this.socket.send(JSON.stringify({
-					action: keys[upKey] || keys[downKey] ? "paddle_move_start" : "paddle_move_stop",
-					direction: lastPressed === upKey ? "up" : lastPressed === downKey ? "down" : e.key === upKey ? "up" : "down",
-					side: this.side
-				}));
+				this.sendInput(
+					keys[upKey] || keys[downKey] ? "paddle_move_start" : "paddle_move_stop",
+					lastPressed === upKey ? "up" : lastPressed === downKey ? "down" : e.key === upKey ? "up" : "down"
+				);
 			}
 		};
 
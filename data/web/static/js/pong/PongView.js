@@ -1,4 +1,4 @@
-import { QuickLobby, SinglePongGame, AIPongGame } from './SinglePongGame.js';
+import { QuickLobby, SinglePongGame, AIPongGame, SpectatorPongGame, ReplayPongGame } from './SinglePongGame.js';
 import { Ball } from './PongComponents.js';
 import { BaseComponent } from '/static/js/index/BaseComponent.js';
 import * as THREE from 'three';
@@ -48,12 +48,16 @@ export class PongView extends BaseComponent {
 		backButton.addEventListener('click', () => {
 			this.activeGames.forEach(game => game.cleanup());
 			this.activeGames.clear();  
-			const hash = window.location.hash.substring(2);
-			Router.go(hash);
+			this.goBack();
 		});
 		
 	}
 
+	goBack() {
+		const hash = window.location.hash.substring(2);
+		Router.go(hash);
+	}
+
 	onDestroy() {
 		if (this.gameElement) { this.gameElement.cleanup(); }
 		for (const game of this.activeGames) {
@@ -68,6 +72,43 @@ export class PongView extends BaseComponent {
 customElements.define('pong-view', PongView);
 
 
+// #/watch/<game_id> and #/replay/<game_id> skip the menu and open the match straight away
+class MatchLinkView extends PongView {
+	constructor(gameId) {
+		super();
+		this.gameId = gameId;
+	}
+
+	async onIni() {
+		await super.onIni();
+		if (!this.element || !this.gameId) return;
+		this.element.querySelector('.pong-menu-container')?.remove();
+		this.gameElement.cleanup();
+		const game = this.createGame();
+		game.startGame();
+	}
+
+	goBack() {
+		window.location.hash = '#/pong';
+	}
+}
+
+export class WatchView extends MatchLinkView {
+	createGame() {
+		return new SpectatorPongGame(this.element, this.gameId, this);
+	}
+}
+
+export class ReplayView extends MatchLinkView {
+	createGame() {
+		return new ReplayPongGame(this.element, this.gameId, this);
+	}
+}
+
+customElements.define('watch-view', WatchView);
+customElements.define('replay-view', ReplayView);
+
+
 export class PongStartMenu {
     constructor(parent, view) {
         this.parent = parent;
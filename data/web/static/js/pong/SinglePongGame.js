@@ -2,6 +2,24 @@ import { AuthService } from '../index/AuthService.js';
 import { Player, Paddle, Ball, ScoreBoard, GameField } from './PongComponents.js';
 import * as THREE from 'three';
 
+// binary frame layout, must match pong/protocol.py
+const GAME_STATE_FRAME = 1;
+
+export function decodeGameState(buffer) {
+	const view = new DataView(buffer);
+	if (view.getUint8(0) !== GAME_STATE_FRAME) return null;
+	return {
+		tick: view.getUint32(1, true),
+		time: view.getFloat64(5, true),
+		ball_x: view.getFloat32(13, true),
+		ball_y: view.getFloat32(17, true),
+		l_paddle_y: view.getFloat32(21, true),
+		r_paddle_y: view.getFloat32(25, true),
+		l_ack: view.getUint32(29, true),
+		r_ack: view.getUint32(33, true),
+	};
+}
+
 export class QuickLobby {
 	constructor(parent, view) {
 		this.parent = parent;
@@ -64,6 +82,16 @@ export class QuickLobby {
 					const game = new MultiPongGame(this.parent, data.state, this.view);
 					game.startGame();
 					break;
+				case 'draining':
+					// server is being redeployed, queue again once it is back
+					this.statusText.textContent = `Server restarting, retrying in ${data.state.retry_after}s...`;
+					setTimeout(() => {
+						if (this.lobbyElement && this.lobbyElement.parentNode) {
+							this.socket = new WebSocket(this.socket.url);
+							this.setupSocketHandlers();
+						}
+					}, data.state.retry_after * 1000);
+					break;
 			}
 		};
 
@@ -123,10 +151,23 @@ export class PongGame {
         this.fieldWidth = 0;
         this.fieldHeight = 0;
 		this.resizeListener = null;
+
+		// snapshot interpolation, render slightly in the past between two server states
+		this.snapshots = [];
+		this.clockOffset = null;
+		this.interpDelay = 100;
+		this.frameDivisor = 1;
+		this.viewTick = undefined;
 	}
 
 	setupSocketHandlers() {
+		this.socket.binaryType = 'arraybuffer';
 		this.socket.onmessage = (event) => {
+			if (event.data instanceof ArrayBuffer) {
+				const state = decodeGameState(event.data);
+				if (state) this.handleGameEvent('game_state', state);
+				return;
+			}
 			const data = JSON.parse(event.data);
 			this.handleGameEvent(data.event, data.state);
 		};
@@ -192,6 +233,7 @@ export class PongGame {
 	startAnimationLoop() {
 		const animate = () => {
 			this.animationFrameId = requestAnimationFrame(animate);
+			this.interpolate();
 			this.renderer.render(this.scene, this.camera);
 		};
 		animate();
@@ -222,6 +264,12 @@ export class PongGame {
 			case "game_start":
 				this.handleGameStart(state);
 				break;
+			case "ping":
+				this.socket.send(JSON.stringify({ action: "pong", id: state.id }));
+				// the server sends us 1 in 'divisor' frames, keep two of them buffered
+				this.interpDelay = this.interpDelay / this.frameDivisor * state.divisor;
+				this.frameDivisor = state.divisor;
+				break;
 			case "game_end":
 				this.updateGameState(state);
 				this.scoreBoard.showWinner(state.winner);
@@ -233,8 +281,53 @@ export class PongGame {
 	}
 
 	updateGameState(state) {
-		this.paddleLeft.update(state.l_paddle_y);
-		this.paddleRight.update(state.r_paddle_y);
+		if (state.time === undefined) return;
+		const offset = Date.now() - state.time;
+		this.clockOffset = this.clockOffset === null
+			? offset
+			: this.clockOffset + (offset - this.clockOffset) * 0.1;
+		this.snapshots.push(state);
+		if (this.snapshots.length > 32) this.snapshots.shift();
+		if (this.player1 && this.player1.predicting) this.player1.reconcile(state.l_paddle_y, state.l_ack);
+		if (this.player2 && this.player2.predicting) this.player2.reconcile(state.r_paddle_y, state.r_ack);
+	}
+
+	interpolate() {
+		if (!this.snapshots.length || !this.ball.mesh) return;
+		const renderTime = Date.now() - this.clockOffset - this.interpDelay;
+		while (this.snapshots.length > 2 && this.snapshots[1].time <= renderTime) {
+			this.snapshots.shift();
+		}
+		const a = this.snapshots[0];
+		const b = this.snapshots[1];
+		if (!b || renderTime <= a.time) {
+			const shown = b && renderTime > a.time ? b : a;
+			this.viewTick = shown.tick;
+			this.applyState(shown);
+			return;
+		}
+		const t = Math.min((renderTime - a.time) / (b.time - a.time), 1);
+		this.viewTick = Math.floor(a.tick + (b.tick - a.tick) * t);
+		// ball was served again, don't slide it across the field
+		if (Math.abs(b.ball_x - a.ball_x) > this.fieldWidth / 2) {
+			this.applyState(b);
+			return;
+		}
+		const lerp = (from, to) => from + (to - from) * t;
+		this.applyState({
+			l_paddle_y: lerp(a.l_paddle_y, b.l_paddle_y),
+			r_paddle_y: lerp(a.r_paddle_y, b.r_paddle_y),
+			ball_x: lerp(a.ball_x, b.ball_x),
+			ball_y: lerp(a.ball_y, b.ball_y),
+		});
+	}
+
+	applyState(state) {
+		// our own paddles are drawn where our inputs put them now, not interpDelay in the past
+		const maxY = this.fieldHeight - this.paddleLeft.dimensions.height;
+		const predicted = (player) => player && player.predicting ? player.predict(this.paddleSpeed, maxY) : null;
+		this.paddleLeft.update(predicted(this.player1) ?? state.l_paddle_y);
+		this.paddleRight.update(predicted(this.player2) ?? state.r_paddle_y);
 		this.ball.update(state.ball_x, state.ball_y);
 	}
 
@@ -251,6 +344,10 @@ export class PongGame {
 		this.createGameElements();
 		this.fieldWidth = state.field_width;
 		this.fieldHeight = state.field_height;
+		this.interpDelay = 2 * 1000 / state.send_rate;
+		this.frameDivisor = 1;
+		this.paddleSpeed = state.paddle_speed;
+		this.snapshots = [];
 		this.setupThreeJS();
 		this.gameField.createMesh(this.scene, state.field_width, state.field_height);
 		this.paddleLeft.update(state.l_paddle_y, state.l_paddle_x, state.paddle_width, state.paddle_height);
@@ -277,6 +374,9 @@ export class PongGame {
 		);
 
 		this.setupPlayers(state);
+		for (const player of [this.player1, this.player2]) {
+			if (player) player.viewTick = () => this.viewTick;
+		}
 	}
 
 	setupPlayers(state) {
@@ -326,6 +426,7 @@ export class AIPongGame extends PongGame {
 		this.socket.onopen = () => {
 			this.socket.send(JSON.stringify({
 				action: "connect",
+				binary: true
 			}));
 		};
 	}
@@ -353,7 +454,8 @@ export class SinglePongGame extends PongGame {
 		this.socket.onopen = () => {
 			this.socket.send(JSON.stringify({
 				action: "connect",
-				mode: this.mode
+				mode: this.mode,
+				binary: true
 			}));
 		};
 	}
@@ -375,6 +477,7 @@ export class MultiPongGame extends PongGame {
 		this.game_id = matchData.game_id;
 		this.game_url = matchData.game_url;
 		this.player_id = matchData.player_id;
+		this.movedRetries = 0;
 	}
 
 	async startGame() {
@@ -384,7 +487,8 @@ export class MultiPongGame extends PongGame {
 		
 		this.socket.onopen = () => {
 			this.socket.send(JSON.stringify({
-				action: "connect"
+				action: "connect",
+				binary: true
 			}));
 		};
 	}
@@ -400,5 +504,141 @@ export class MultiPongGame extends PongGame {
 			? this.cameraSetup('left')
 			: this.cameraSetup('right'));
 	}
+
+	handleGameEvent(event, state) {
+		if (event === "moved") {
+			// the game lives on another server worker, reconnect once routing caught up
+			if (++this.movedRetries > state.max_retries) {
+				this.view.insertBackButton();
+				return;
+			}
+			setTimeout(() => this.startGame(), state.retry_after * 1000);
+			return;
+		}
+		super.handleGameEvent(event, state);
+	}
 }
 
+
+export class SpectatorPongGame extends PongGame {
+	constructor(container, gameId, view) {
+		super(container, view);
+		this.game_id = gameId;
+	}
+
+	async startGame() {
+		document.cookie = `jwt=${AuthService.jwt}; path=/`;
+		this.socket = new WebSocket(`wss://${window.location.host}/wss/mpong/watch/${this.game_id}/`);
+		this.setupSocketHandlers();
+		this.socket.onclose = () => {
+			// closed before game_start: no such match, leave a way back to the menu
+			if (!this.gameDiv) this.view.insertBackButton();
+		};
+		this.socket.onopen = () => {
+			this.socket.send(JSON.stringify({
+				action: "connect",
+				binary: true
+			}));
+		};
+	}
+
+	handleGameEvent(event, state) {
+		if (event === "spectate_full") {
+			this.view.insertBackButton();
+			return;
+		}
+		super.handleGameEvent(event, state);
+	}
+
+	handleGameStart(state) {
+		super.handleGameStart(state);
+		// spectators get every other frame, keep two of them in the interpolation buffer
+		this.interpDelay = 2 * 1000 / state.spectate_rate;
+	}
+
+	setupPlayers(state) {
+		this.player1 = new Player(state.player1_id, this.paddleLeft, this.socket, "left");
+		this.player2 = new Player(state.player2_id, this.paddleRight, this.socket, "right");
+		this.cameraSetup();
+	}
+}
+
+export class ReplayPongGame extends PongGame {
+	constructor(container, gameId, view) {
+		super(container, view);
+		this.game_id = gameId;
+		this.tickRate = 120;
+		this.currentTick = 0;
+		this.paused = false;
+		this.keyListener = null;
+	}
+
+	async startGame() {
+		document.cookie = `jwt=${AuthService.jwt}; path=/`;
+		this.socket = new WebSocket(`wss://${window.location.host}/wss/mpong/replay/${this.game_id}/`);
+		this.setupSocketHandlers();
+		this.socket.onclose = () => {
+			// closed before game_start: no such match, leave a way back to the menu
+			if (!this.gameDiv) this.view.insertBackButton();
+		};
+		this.socket.onopen = () => {
+			this.socket.send(JSON.stringify({
+				action: "connect",
+				binary: true
+			}));
+		};
+	}
+
+	send(message) {
+		if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+			this.socket.send(JSON.stringify(message));
+		}
+	}
+
+	handleGameEvent(event, state) {
+		switch(event) {
+			case "game_state":
+				this.currentTick = state.tick;
+				super.handleGameEvent(event, state);
+				break;
+			case "replay_seek":
+				// drop buffered states from before the jump
+				this.snapshots = [];
+				this.clockOffset = null;
+				this.currentTick = state.tick;
+				break;
+			default:
+				super.handleGameEvent(event, state);
+		}
+	}
+
+	setupPlayers(state) {
+		this.tickRate = state.tick_rate;
+		this.player1 = new Player(state.player1_id, this.paddleLeft, this.socket, "left");
+		this.player2 = new Player(state.player2_id, this.paddleRight, this.socket, "right");
+		this.cameraSetup();
+
+		// 1/2/3 pick the playback speed, space pauses, arrows seek 5 seconds
+		this.keyListener = (e) => {
+			const speeds = state.speeds;
+			if (['1', '2', '3'].includes(e.key) && speeds[Number(e.key) - 1]) {
+				this.send({ action: "speed", speed: speeds[Number(e.key) - 1] });
+			} else if (e.key === ' ') {
+				this.paused = !this.paused;
+				this.send({ action: this.paused ? "pause" : "play" });
+			} else if (e.key === 'ArrowLeft' || e.key === 'ArrowRight') {
+				const delta = (e.key === 'ArrowLeft' ? -5 : 5) * this.tickRate;
+				this.send({ action: "seek", tick: Math.max(0, this.currentTick + delta) });
+			}
+		};
+		document.addEventListener('keydown', this.keyListener);
+	}
+
+	cleanup() {
+		if (this.keyListener) {
+			document.removeEventListener('keydown', this.keyListener);
+			this.keyListener = null;
+		}
+		super.cleanup();
+	}
+}
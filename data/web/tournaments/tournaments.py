@@ -1,5 +1,6 @@
 from .models import Tournament
 from pong.models import OngoingGame ,CompletedGame
+from pong.timers import TimerWheel
 from django.apps import apps
 from django.utils import timezone
 from channels.db import database_sync_to_async
@@ -7,6 +8,9 @@ import asyncio, time, logging
 
 logger = logging.getLogger('pong')
 
+ROUND_TIMEOUT = 120 # seconds a round's matches have to start
+ROUND_RECHECK = 30 # seconds between checks of a round past its timeout whose matches are still running
+
 class TournamentManager:
 	running = False
 	task = None
@@ -16,6 +20,9 @@ class TournamentManager:
 		if not self.running:
 			self.running = True
 			self.loop = loop
+			# the manager runs its own event loop thread, so it gets its own wheel
+			self.timers = TimerWheel(resolution=1.0)
+			self.round_timers = {} # tournament_id -> (round index, TimerHandle)
 			self.loop.create_task(self.poll_tournaments())
 			logger.info('Tournament manager started')
 
@@ -31,6 +38,9 @@ class TournamentManager:
 			try:
 				Tournament = apps.get_model('tournaments', 'Tournament')
 				tournaments = await self.get_active_tournaments()
+				active = {tournament.tournament_id for tournament in tournaments}
+				for tournament_id in [t for t in self.round_timers if t not in active]:
+					self.cancel_round_timeout(tournament_id)
 				for tournament in tournaments:
 					await self.process_tournament(tournament)
 			except Exception as e:
@@ -43,9 +53,7 @@ class TournamentManager:
 		if not tournament.rounds:
 			return
 		
-		timed_out = await self.round_timeout(tournament)
-		if timed_out:
-			return
+		self.schedule_round_timeout(tournament)
 
 		current_round = tournament.rounds[tournament.current_round]
 		for match in current_round:
@@ -80,16 +88,41 @@ class TournamentManager:
 	def get_completed_game(self, game_id: str):
 		return CompletedGame.find_by_id(game_id)
 
+	def schedule_round_timeout(self, tournament : Tournament):
+		"""One timer per tournament round, instead of recomputing every round's age on every poll."""
+		scheduled = self.round_timers.get(tournament.tournament_id)
+		if scheduled and scheduled[0] == tournament.current_round:
+			return
+		self.cancel_round_timeout(tournament.tournament_id)
+		elapsed = (timezone.now() - tournament.current_round_created_at).total_seconds()
+		handle = self.timers.call_later(max(0, ROUND_TIMEOUT - elapsed), self.expire_round,
+			tournament.tournament_id, tournament.current_round)
+		self.round_timers[tournament.tournament_id] = (tournament.current_round, handle)
+
+	def cancel_round_timeout(self, tournament_id : str):
+		if (scheduled := self.round_timers.pop(tournament_id, None)):
+			scheduled[1].cancel()
+
+	async def expire_round(self, tournament_id : str, round_index : int):
+		# the entry stays while the round lasts, or the next poll would re-arm a 0 delay timer
+		scheduled = self.round_timers.get(tournament_id)
+		try:
+			if await self.round_timeout(tournament_id, round_index):
+				self.round_timers.pop(tournament_id, None)
+				return
+		except Exception as e:
+			logger.error(f'Error checking round timeout of {tournament_id}: {str(e)}')
+		if self.round_timers.get(tournament_id) is scheduled:
+			# a started match can still be abandoned without completing, look again later
+			handle = self.timers.call_later(ROUND_RECHECK, self.expire_round, tournament_id, round_index)
+			self.round_timers[tournament_id] = (round_index, handle)
+
+
 	@database_sync_to_async
-	def round_timeout(self, tournament: Tournament) -> bool:
-		if tournament.status != 'IN_PROGRESS' or not tournament.rounds:
-			return False
-			
-		current_time = timezone.now()
-		round_time = tournament.current_round_created_at
-		time_diff = (current_time - round_time).total_seconds()
-		
-		if time_diff < 120:
+	def round_timeout(self, tournament_id : str, round_index : int) -> bool:
+		tournament = Tournament.objects.filter(tournament_id=tournament_id).first()
+		if (not tournament or tournament.status != 'IN_PROGRESS' or not tournament.rounds
+			or tournament.current_round != round_index):
 			return False
 		
 		current_round = tournament.rounds[tournament.current_round]